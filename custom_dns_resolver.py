@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
-import socket, struct, time, datetime, random
+import asyncio, atexit, signal, socket, struct, time, datetime, random, functools
+from cachetools import TTLCache
 
 # --- Root servers (subset) ---
 ROOT_SERVERS = [
@@ -7,79 +8,142 @@ ROOT_SERVERS = [
     "192.203.230.10", "192.5.5.241", "192.112.36.4", "198.97.190.53"
 ]
 
-CACHE = {}
 CACHE_TTL = 300  # seconds
+CACHE_SIZE = 10000
+# Entries expire CACHE_TTL seconds after insertion; the least recently used
+# entry is evicted once CACHE_SIZE is reached.
+CACHE = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
 LOG_FILE = "dns_server.log"
+RECV_BUFFER = 16 << 20  # listening socket buffer; capped by net.core.rmem_max
+
+# Opened once and buffered; flushed when the buffer fills and at exit.
+_LOG = open(LOG_FILE, "a", buffering=1 << 16)
+atexit.register(_LOG.close)
 
 # -----------------------------------------------------
 #  Utilities
 # -----------------------------------------------------
 def log_entry(domain, mode, client_ip, step, server_ip, response, rtt, total_time, cache_status):
-    with open(LOG_FILE, "a") as f:
-        f.write(
-            f"{datetime.datetime.utcnow().isoformat()},{domain},{mode},{client_ip},"
-            f"{step},{server_ip},{response},{round(rtt,2)}ms,{round(total_time,2)}ms,{cache_status}\n"
-        )
+    _LOG.write(
+        f"{datetime.datetime.utcnow().isoformat()},{domain},{mode},{client_ip},"
+        f"{step},{server_ip},{response},{round(rtt,2)}ms,{round(total_time,2)}ms,{cache_status}\n"
+    )
+
+@functools.lru_cache(maxsize=4096)
+def _encode_question(domain):
+    # The question section only depends on the name; every hop of every
+    # lookup for the same domain reuses it.
+    ba = bytearray()
+    for label in domain.split("."):
+        e = label.encode()
+        ba.append(len(e))
+        ba += e
+    ba.append(0)
+    ba += struct.pack("!HH", 1, 1)
+    return bytes(ba)
 
 def build_query(domain):
-    tid = random.randint(0, 65535)
+    tid = random.getrandbits(16)
     header = struct.pack("!HHHHHH", tid, 0x0100, 1, 0, 0, 0)
-    qname = b"".join(bytes([len(x)]) + x.encode() for x in domain.split(".")) + b"\x00"
-    question = qname + struct.pack("!HH", 1, 1)
-    return tid, header + question
+    return tid, header + _encode_question(domain)
+
+_COUNTS = struct.Struct("!HHH")      # ANCOUNT, NSCOUNT, ARCOUNT
+_RR_FIXED = struct.Struct("!HHIH")   # TYPE, CLASS, TTL, RDLENGTH
 
 def parse_response(data):
     """Return tuple (A_record_IPs, next_NS_names)."""
     ips, nss = [], []
     try:
-        ancount = struct.unpack("!H", data[6:8])[0]
-        nscount = struct.unpack("!H", data[8:10])[0]
-        arcount = struct.unpack("!H", data[10:12])[0]
+        mv = memoryview(data)  # slices below are views, not copies
+        ancount, nscount, arcount = _COUNTS.unpack_from(mv, 6)
         total = ancount + nscount + arcount
         if total == 0:
             return [], []
 
         offset = 12
         # skip QNAME
-        while data[offset] != 0:
-            offset += data[offset] + 1
+        while mv[offset] != 0:
+            offset += mv[offset] + 1
         offset += 5  # null + QTYPE/QCLASS
 
         for _ in range(total):
-            if data[offset] & 0xC0 == 0xC0:
+            if mv[offset] & 0xC0 == 0xC0:
                 offset += 2
             else:
-                while data[offset] != 0:
-                    offset += data[offset] + 1
+                while mv[offset] != 0:
+                    offset += mv[offset] + 1
                 offset += 1
 
-            rtype, rclass, ttl, rdlength = struct.unpack("!HHIH", data[offset:offset+10])
+            rtype, rclass, ttl, rdlength = _RR_FIXED.unpack_from(mv, offset)
             offset += 10
-            rdata = data[offset:offset+rdlength]
-            offset += rdlength
 
             if rtype == 1 and rdlength == 4:
-                ips.append(".".join(map(str, rdata)))
+                ips.append(socket.inet_ntoa(mv[offset:offset+4]))
             elif rtype == 2:  # NS
+                rdata = mv[offset:offset+rdlength]
                 ns = []
                 i = 0
                 while i < len(rdata) and rdata[i] != 0:
                     if rdata[i] & 0xC0 == 0xC0:
                         break
                     l = rdata[i]
-                    ns.append(rdata[i+1:i+1+l].decode(errors="ignore"))
+                    ns.append(rdata[i+1:i+1+l].tobytes().decode(errors="ignore"))
                     i += l + 1
                 nss.append(".".join(ns))
+            offset += rdlength
     except Exception:
         pass
     return ips, nss
 
+# -----------------------------------------------------
+#  Upstream transport
+# -----------------------------------------------------
+class ResolverProto(asyncio.DatagramProtocol):
+    """One upstream UDP socket shared by every in-flight lookup.
+
+    Replies are matched to waiting lookups on (server IP, transaction ID).
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 2:
+            return
+        fut = self.pending.get((addr[0], struct.unpack_from("!H", data)[0]))
+        if fut is not None and not fut.done():
+            fut.set_result(data)
+
+    async def query(self, server_ip, domain, timeout):
+        tid, packet = build_query(domain)
+        while (server_ip, tid) in self.pending:
+            tid, packet = build_query(domain)
+        key = (server_ip, tid)
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[key] = fut
+        try:
+            self.transport.sendto(packet, (server_ip, 53))
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self.pending.pop(key, None)
+
+async def _ns_address(ns):
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(ns, None, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        return infos[0][4][0]
+    except Exception:
+        return None
+
 # -----------------------------------------------------
 #  Core iterative resolver
 # -----------------------------------------------------
-def iterative_resolve(domain, client_ip):
-    if domain in CACHE and CACHE[domain][1] > time.time():
-        ip = CACHE[domain][0]
+async def iterative_resolve(domain, client_ip, upstream):
+    ip = CACHE.get(domain)
+    if ip is not None:
         log_entry(domain, "Iterative", client_ip, "Cache", ip, ip, 0, 0, "HIT")
         return ip
 
@@ -88,39 +152,29 @@ def iterative_resolve(domain, client_ip):
     step = "Root"
     for depth in range(3):  # Root -> TLD -> Authoritative
         server_ip = current_servers[0]
-        tid, packet = build_query(domain)
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.settimeout(3)
         step_start = time.time()
 
         try:
-            sock.sendto(packet, (server_ip, 53))
-            data, _ = sock.recvfrom(4096)
+            data = await upstream.query(server_ip, domain, 3)
             rtt = (time.time() - step_start) * 1000
             ips, nss = parse_response(data)
         except Exception:
-            sock.close()
             log_entry(domain, "Iterative", client_ip, step, server_ip, "TIMEOUT", 0, (time.time() - start_total)*1000, "MISS")
             return None
-        sock.close()
 
         # A record found
         if ips:
             total_time = (time.time() - start_total)*1000
-            CACHE[domain] = (ips[0], time.time() + CACHE_TTL)
+            CACHE[domain] = ips[0]
             log_entry(domain, "Iterative", client_ip, step, server_ip, ips[0], rtt, total_time, "MISS")
             return ips[0]
 
         # NS referral found
         if nss:
             step = "TLD" if depth == 0 else "Authoritative"
-            next_servers = []
-            for ns in nss:
-                try:
-                    ns_ip = socket.gethostbyname(ns)
-                    next_servers.append(ns_ip)
-                except Exception:
-                    continue
+            # Look up all NS names at once instead of one blocking call each.
+            ns_ips = await asyncio.gather(*(_ns_address(ns) for ns in nss))
+            next_servers = [ip for ip in ns_ips if ip]
             if not next_servers:
                 log_entry(domain, "Iterative", client_ip, step, server_ip, "Referral w/ no A", rtt, (time.time()-start_total)*1000, "MISS")
                 return None
@@ -135,45 +189,72 @@ def iterative_resolve(domain, client_ip):
 # -----------------------------------------------------
 #  UDP listener
 # -----------------------------------------------------
-def main():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("10.0.0.5", 53))
-    print("[+] Custom DNS Resolver running on 10.0.0.5:53 ...")
+async def handle_query(transport, upstream, data, addr):
+    client_ip, client_port = addr
+    domain = None
+    try:
+        i = 12
+        parts = []
+        while data[i] != 0:
+            l = data[i]; parts.append(data[i+1:i+1+l].decode()); i += l+1
+        domain = ".".join(parts)
+    except Exception:
+        pass
+    if not domain:
+        return
 
-    while True:
-        data, addr = sock.recvfrom(1024)
-        client_ip, client_port = addr
-        domain = None
-        try:
-            i = 12
-            parts = []
-            while data[i] != 0:
-                l = data[i]; parts.append(data[i+1:i+1+l].decode()); i += l+1
-            domain = ".".join(parts)
-        except Exception:
-            pass
-        if not domain:
-            continue
+    ip = await iterative_resolve(domain, client_ip, upstream)
+    if not ip:
+        return
 
-        ip = iterative_resolve(domain, client_ip)
-        if not ip:
-            continue
+    # Build a minimal DNS reply
+    tid = data[:2]
+    flags = b"\x81\x80"  # standard response, recursion available
+    qdcount = b"\x00\x01"
+    ancount = b"\x00\x01"
+    nscount = arcount = b"\x00\x00"
+    header = tid + flags + qdcount + ancount + nscount + arcount
+    # copy question
+    i = 12
+    while data[i] != 0:
+        i += data[i] + 1
+    question = data[12:i+5]
+    answer = b"\xc0\x0c" + struct.pack("!HHI", 1, 1, 60) + struct.pack("!H", 4)
+    answer += socket.inet_aton(ip)
+    transport.sendto(header + question + answer, addr)
 
-        # Build a minimal DNS reply
-        tid = data[:2]
-        flags = b"\x81\x80"  # standard response, recursion available
-        qdcount = b"\x00\x01"
-        ancount = b"\x00\x01"
-        nscount = arcount = b"\x00\x00"
-        header = tid + flags + qdcount + ancount + nscount + arcount
-        # copy question
-        i = 12
-        while data[i] != 0:
-            i += data[i] + 1
-        question = data[12:i+5]
-        answer = b"\xc0\x0c" + struct.pack("!HHI", 1, 1, 60) + struct.pack("!H", 4)
-        answer += bytes(map(int, ip.split(".")))
-        sock.sendto(header + question + answer, addr)
+class ServerProto(asyncio.DatagramProtocol):
+    """Client-facing socket; every query is resolved in its own task."""
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.transport = None
+        self.tasks = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        task = asyncio.ensure_future(handle_query(self.transport, self.upstream, data, addr))
+        self.tasks.add(task)  # keep a reference until the task finishes
+        task.add_done_callback(self.tasks.discard)
+
+async def serve(listen_ip="10.0.0.5", port=53):
+    loop = asyncio.get_running_loop()
+    _, upstream = await loop.create_datagram_endpoint(ResolverProto, local_addr=("0.0.0.0", 0))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Room for query bursts to queue in the kernel rather than being dropped.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+    sock.bind((listen_ip, port))
+    await loop.create_datagram_endpoint(lambda: ServerProto(upstream), sock=sock)
+    print(f"[+] Custom DNS Resolver running on {listen_ip}:{port} ...")
+    stop = asyncio.Event()
+    # Treat `kill` like Ctrl-C so the buffered log is flushed on the way out.
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    await stop.wait()
+
+def main():
+    asyncio.run(serve())
 
 if __name__ == "__main__":
     main()
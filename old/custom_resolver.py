@@ -5,10 +5,22 @@ from __future__ import annotations
 
 import argparse
 import csv
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import io
+import os
+import queue
+import signal
 import socket
+import struct
+import sys
 import threading
 import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Sequence, Tuple
@@ -39,6 +51,24 @@ ROOT_SERVERS: Tuple[str, ...] = (
     "202.12.27.33",
 )
 
+# Large receive buffer so bursts from several clients queue in the kernel
+# instead of being dropped (Linux caps this at net.core.rmem_max).
+RECV_BUFFER_BYTES = 16 << 20
+# Datagrams drained per recvmmsg() call when --batch-recv is enabled.
+RECV_BATCH_SIZE = 32
+# Log rows buffered in memory before the writer thread appends them.
+LOG_BUFFER_BYTES = 1 << 16
+
+# Upper bound on how long any answer stays cached, regardless of its TTL.
+MAX_CACHE_TTL = 3600
+# How long a duplicate query waits for an identical in-flight lookup before
+# resolving on its own (seconds).
+INFLIGHT_WAIT_S = 15.0
+# Maximum number of NS names listed in a logged REFERRAL summary.
+SUMMARY_MAX_NAMES = 8
+# Idle time after which an inbound TCP connection is closed (seconds).
+TCP_IDLE_TIMEOUT_S = 30.0
+
 
 @dataclass
 class CacheEntry:
@@ -49,6 +79,14 @@ class CacheEntry:
         return time.time() < self.expiry
 
 
+@dataclass
+class InFlight:
+    """An upstream lookup in progress that identical queries can wait on."""
+
+    done: threading.Event
+    result: Optional[Tuple[List[dns.rrset.RRset], int]] = None
+
+
 @dataclass
 class TraceEvent:
     server: str
@@ -61,34 +99,80 @@ class TraceEvent:
 
 
 class ResolverLogger:
-    """Thread-safe CSV logger for resolver activity."""
+    """Thread-safe CSV logger for resolver activity.
 
-    def __init__(self, path: Path) -> None:
-        path.parent.mkdir(parents=True, exist_ok=True)
+    Callers only enqueue events; a single writer thread formats the rows into
+    an in-memory buffer and appends it to the file every ``flush_interval``
+    seconds (and on close). Each append is one ``write`` of whole rows on an
+    ``O_APPEND`` descriptor, so several resolver processes can share a log.
+    A non-positive ``flush_interval`` holds rows until ``LOG_BUFFER_BYTES``
+    accumulate or the logger closes.
+    """
+
+    _STOP = object()
+    HEADER = (
+        "timestamp",
+        "domain",
+        "mode",
+        "server_contacted",
+        "step",
+        "response_or_referral",
+        "rtt_s",
+        "total_time_s",
+        "cache_status",
+        "request_id",
+    )
+
+    def __init__(self, path: Path, flush_interval: float = 0.5) -> None:
+        self.ensure_header(path)
         self._path = path
-        self._lock = threading.Lock()
-        self._file = path.open("a", newline="")
-        self._writer = csv.writer(self._file)
-        if self._file.tell() == 0:
-            self._writer.writerow(
-                [
-                    "timestamp",
-                    "domain",
-                    "mode",
-                    "server_contacted",
-                    "step",
-                    "response_or_referral",
-                    "rtt_s",
-                    "total_time_s",
-                    "cache_status",
-                    "request_id",
-                ]
-            )
-            self._file.flush()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._flush_interval = flush_interval
+        self._queue: "queue.SimpleQueue[object]" = queue.SimpleQueue()
+        self._drainer = threading.Thread(target=self._drain, daemon=True)
+        self._drainer.start()
 
-    def log_event(self, domain: str, mode: str, event: TraceEvent, request_id: str) -> None:
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event.event_time))
-        with self._lock:
+    @classmethod
+    def ensure_header(cls, path: Path) -> None:
+        """Create the log with its header row unless it already has content."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", newline="") as handle:
+            if handle.tell() == 0:
+                csv.writer(handle).writerow(cls.HEADER)
+
+    def _flush(self) -> None:
+        data = self._buffer.getvalue()
+        if not data:
+            return
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        payload = data.encode()
+        while payload:
+            written = os.write(self._fd, payload)
+            payload = payload[written:]
+
+    def _drain(self) -> None:
+        last_flush = time.monotonic()
+        # Timestamps have second resolution; format each second only once.
+        last_second = -1
+        timestamp = ""
+        timed = self._flush_interval > 0
+        while True:
+            try:
+                item = self._queue.get(timeout=self._flush_interval if timed else None)
+            except queue.Empty:
+                self._flush()
+                last_flush = time.monotonic()
+                continue
+            if item is self._STOP:
+                break
+            domain, mode, event, request_id = item
+            second = int(event.event_time)
+            if second != last_second:
+                timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+                last_second = second
             self._writer.writerow(
                 [
                     timestamp,
@@ -103,11 +187,139 @@ class ResolverLogger:
                     request_id,
                 ]
             )
-            self._file.flush()
+            if (timed and time.monotonic() - last_flush >= self._flush_interval) or self._buffer.tell() >= LOG_BUFFER_BYTES:
+                self._flush()
+                last_flush = time.monotonic()
+        self._flush()
+        os.close(self._fd)
+
+    def log_event(self, domain: str, mode: str, event: TraceEvent, request_id: str) -> None:
+        self._queue.put((domain, mode, event, request_id))
 
     def close(self) -> None:
+        self._queue.put(self._STOP)
+        self._drainer.join()
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+class BatchReceiver:
+    """Drain up to ``batch_size`` IPv4 datagrams per syscall with Linux recvmmsg().
+
+    Python's socket module has no recvmmsg binding, so this calls libc through
+    ctypes. Use :meth:`available` to check for support before constructing.
+    """
+
+    _MSG_WAITFORONE = 0x10000
+    _SOCKADDR_IN_LEN = 16
+
+    def __init__(self, sock: socket.socket, batch_size: int = RECV_BATCH_SIZE, bufsize: int = 2048) -> None:
+        self._recvmmsg = self._load()
+        if self._recvmmsg is None:
+            raise OSError("recvmmsg() is not available on this platform")
+        self._fd = sock.fileno()
+        self._count = batch_size
+        self._buffers = [ctypes.create_string_buffer(bufsize) for _ in range(batch_size)]
+        self._names = [ctypes.create_string_buffer(self._SOCKADDR_IN_LEN) for _ in range(batch_size)]
+        self._iovecs = (_IOVec * batch_size)()
+        self._msgs = (_MMsgHdr * batch_size)()
+        for i in range(batch_size):
+            self._iovecs[i].iov_base = ctypes.cast(self._buffers[i], ctypes.c_void_p)
+            self._iovecs[i].iov_len = bufsize
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = ctypes.cast(self._names[i], ctypes.c_void_p)
+            hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            hdr.msg_iovlen = 1
+
+    @staticmethod
+    def _load():
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            func = libc.recvmmsg
+        except (OSError, AttributeError):
+            return None
+        func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        func.restype = ctypes.c_int
+        return func
+
+    @classmethod
+    def available(cls) -> bool:
+        return cls._load() is not None
+
+    def receive(self) -> List[Tuple[bytes, Tuple[str, int]]]:
+        """Block for at least one datagram, then return every one already queued."""
+        for i in range(self._count):
+            self._msgs[i].msg_hdr.msg_namelen = self._SOCKADDR_IN_LEN
+        received = self._recvmmsg(self._fd, ctypes.byref(self._msgs), self._count, self._MSG_WAITFORONE, None)
+        if received < 0:
+            err = ctypes.get_errno()
+            # Interrupted: return to Python so pending signal handlers (SIGTERM) run.
+            if err == errno.EINTR:
+                return []
+            raise OSError(err, os.strerror(err))
+        batch: List[Tuple[bytes, Tuple[str, int]]] = []
+        for i in range(received):
+            name = self._names[i].raw
+            port = int.from_bytes(name[2:4], "big")
+            addr = socket.inet_ntoa(name[4:8])
+            batch.append((self._buffers[i].raw[: self._msgs[i].msg_len], (addr, port)))
+        return batch
+
+
+class _TcpClient:
+    """An accepted TCP connection whose queries are answered by the worker pool.
+
+    Replies are written whole, with their two-byte length prefix, under a lock
+    and in completion order, so pipelined queries need not wait for each other.
+    The socket closes once the peer stops sending and every query is answered.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        self._sock = sock
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._reading = True
+
+    def hold(self) -> None:
+        with self._lock:
+            self._pending += 1
+
+    def reply(self, wire: Optional[bytes]) -> None:
         with self._lock:
-            self._file.close()
+            if wire is not None:
+                try:
+                    self._sock.sendall(struct.pack("!H", len(wire)) + wire)
+                except OSError:
+                    pass
+            self._pending -= 1
+            if not self._reading and not self._pending:
+                self._sock.close()
+
+    def finish_reading(self) -> None:
+        with self._lock:
+            self._reading = False
+            if not self._pending:
+                self._sock.close()
 
 
 class ResolverServer:
@@ -122,6 +334,11 @@ class ResolverServer:
         recursive_default: bool,
         logger: ResolverLogger,
         root_servers: Sequence[str],
+        max_cache: int = 10000,
+        worker_threads: int = 32,
+        race_transport: bool = False,
+        reuse_port: bool = False,
+        batch_recv: bool = False,
     ) -> None:
         self.listen_ip = listen_ip
         self.listen_port = listen_port
@@ -130,12 +347,55 @@ class ResolverServer:
         self.recursive_default = recursive_default
         self.logger = logger
         self.root_servers = list(root_servers)
+        self.max_cache = max_cache
+        self.worker_threads = max(1, worker_threads)
+        self.race_transport = race_transport
+        self.batch_recv = batch_recv
 
-        self._cache: Dict[Tuple[str, int], CacheEntry] = {}
+        # LRU order: least recently used entries sit at the front.
+        self._cache: "OrderedDict[Tuple[str, int], CacheEntry]" = OrderedDict()
         self._cache_lock = threading.Lock()
+        # Min-heap of (expiry, key) so expired entries are dropped lazily in
+        # O(log n) each, without scanning the whole cache.
+        self._expiry_heap: List[Tuple[float, Tuple[str, int]]] = []
+        # Lookups in progress, keyed like the cache plus the recursion mode.
+        self._inflight: Dict[Tuple[str, int, bool], InFlight] = {}
+        # Delegation cache: zone name (e.g. "com.") -> (nameserver IPs, expiry).
+        self._deleg_cache: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+        self._deleg_lock = threading.Lock()
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Several worker processes bind the same address; the kernel
+            # spreads incoming queries across their sockets.
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_BYTES)
+        # DNS over TCP on the same address, e.g. for dns_batch_runner --pipeline.
+        self._tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self._tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._shutdown = threading.Event()
+        # Per-thread upstream UDP socket, reused across _query_server calls.
+        self._thread_local = threading.local()
+        # Queries received by serve() are handled by a fixed pool of workers;
+        # items carry the TCP connection to answer on, or None for UDP.
+        self._work_queue: "queue.SimpleQueue[Optional[Tuple[bytes, Tuple[str, int], Optional[_TcpClient]]]]" = (
+            queue.SimpleQueue()
+        )
+        self._workers: List[threading.Thread] = []
+        # Runs the UDP and TCP legs of raced upstream queries.
+        self._race_pool: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(max_workers=2 * self.worker_threads) if race_transport else None
+        )
+        # Resolves the NS names of glueless referrals in parallel.
+        self._ns_pool = ThreadPoolExecutor(max_workers=4 * self.worker_threads)
+
+        # One upstream resolver shared by every request thread; its settings
+        # are fixed here and never mutated afterwards, so lookups need no lock.
+        self._upstream = dns.resolver.Resolver(configure=True)
+        self._upstream.lifetime = self.timeout
+        self._upstream.nameservers = list(self._safe_system_nameservers())
 
     # --- Helper for safe upstream resolvers ---------------------------
     def _safe_system_nameservers(self) -> Sequence[str]:
@@ -161,28 +421,42 @@ class ResolverServer:
 
     # --- Cache helpers -------------------------------------------------
     def _cache_key(self, qname: str, qtype: int) -> Tuple[str, int]:
-        return qname.lower(), qtype
+        # Names are usually lowercase already, which skips the copy; interning
+        # lets equal keys share one string object across cache entries.
+        low = qname if qname.islower() else qname.lower()
+        return sys.intern(low), qtype
 
-    def _cache_lookup(self, qname: str, qtype: int) -> Optional[List[dns.rrset.RRset]]:
+    def _cache_lookup(
+        self, qname: str, qtype: int, adjust_ttl: bool = False
+    ) -> Optional[List[dns.rrset.RRset]]:
+        """Return the cached RRsets for ``qname``/``qtype`` if still fresh.
+
+        Cached RRsets are shared and must be treated as read-only. Pass
+        ``adjust_ttl=True`` to get copies whose TTL is lowered to the time
+        remaining before expiry.
+        """
         key = self._cache_key(qname, qtype)
         with self._cache_lock:
+            self._expire_locked(time.time())
             entry = self._cache.get(key)
             if not entry:
                 return None
             if entry.fresh():
-                # Return shallow copies so TTL counters remain intact.
-                copies: List[dns.rrset.RRset] = []
-                for rrset in entry.rrsets:
-                    if hasattr(rrset, "copy"):
-                        try:
-                            copies.append(rrset.copy())
-                            continue
-                        except Exception:
-                            pass
-                    copies.append(rrset)
-                return copies
-            self._cache.pop(key, None)
-            return None
+                self._cache.move_to_end(key)
+                rrsets = entry.rrsets
+                expiry = entry.expiry
+            else:
+                self._cache.pop(key, None)
+                return None
+        if not adjust_ttl:
+            return rrsets
+        remaining = max(int(expiry - time.time()), 0)
+        copies: List[dns.rrset.RRset] = []
+        for rrset in rrsets:
+            copy = rrset.copy()
+            copy.update_ttl(remaining)
+            copies.append(copy)
+        return copies
 
     def _cache_store(self, qname: str, qtype: int, rrsets: List[dns.rrset.RRset]) -> None:
         if not self.cache_enabled:
@@ -195,22 +469,106 @@ class ResolverServer:
                 ttl_values.append(int(ttl))
         if not ttl_values:
             return
-        ttl = min(ttl_values)
+        ttl = min(min(ttl_values), MAX_CACHE_TTL)
         if ttl <= 0:
             return
         expiry = time.time() + ttl
         key = self._cache_key(qname, qtype)
+        # RRsets are only ever read (serialised into responses), so store
+        # them by reference rather than copying.
         with self._cache_lock:
-            stored: List[dns.rrset.RRset] = []
-            for rrset in rrsets:
-                if hasattr(rrset, "copy"):
-                    try:
-                        stored.append(rrset.copy())
-                        continue
-                    except Exception:
-                        pass
-                stored.append(rrset)
-            self._cache[key] = CacheEntry(stored, expiry)
+            self._expire_locked(expiry - ttl)
+            self._cache[key] = CacheEntry(list(rrsets), expiry)
+            self._cache.move_to_end(key)
+            heap = self._expiry_heap
+            heapq.heappush(heap, (expiry, key))
+            while len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+            # Superseded and evicted entries linger in the heap until their
+            # expiry; rebuild it from the live entries so it stays O(max_cache).
+            if len(heap) > 2 * self.max_cache:
+                heap[:] = [(entry.expiry, k) for k, entry in self._cache.items()]
+                heapq.heapify(heap)
+
+    def _expire_locked(self, now: float) -> None:
+        """Pop expired heap entries; caller must hold ``_cache_lock``."""
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expiry, key = heapq.heappop(heap)
+            entry = self._cache.get(key)
+            # Skip heap entries superseded by a later store or already evicted.
+            if entry is not None and entry.expiry == expiry:
+                del self._cache[key]
+
+    # --- Delegation cache ----------------------------------------------
+    def _delegation_lookup(self, qname: str) -> Optional[Tuple[str, List[str]]]:
+        """Return the closest cached delegation enclosing ``qname``, if any."""
+        if not self.cache_enabled:
+            return None
+        labels = qname.lower().rstrip(".").split(".")
+        now = time.time()
+        with self._deleg_lock:
+            for i in range(len(labels)):
+                zone = ".".join(labels[i:]) + "."
+                cached = self._deleg_cache.get(zone)
+                if cached is None:
+                    continue
+                ips, expiry = cached
+                if expiry > now:
+                    self._deleg_cache.move_to_end(zone)
+                    return zone, ips
+                del self._deleg_cache[zone]
+        return None
+
+    def _referral_rrset(
+        self, qname: dns.name.Name, current_zone: dns.name.Name, response: dns.message.Message
+    ) -> Optional[dns.rrset.RRset]:
+        """Return the referral's NS RRset if it is in bailiwick, else None.
+
+        The delegated zone must lie strictly below ``current_zone`` (the zone
+        of the server that was asked) and enclose ``qname``.
+        """
+        for rrset in response.authority:
+            if rrset.rdtype != dns.rdatatype.NS:
+                continue
+            zone = rrset.name
+            if zone != current_zone and zone.is_subdomain(current_zone) and qname.is_subdomain(zone):
+                return rrset
+            return None
+        return None
+
+    def _delegation_store(
+        self, current_zone: dns.name.Name, ns_rrset: dns.rrset.RRset, response: dns.message.Message
+    ) -> None:
+        """Cache an in-bailiwick referral (see ``_referral_rrset``) with its glue."""
+        if not self.cache_enabled:
+            return
+        # Only glue for this delegation's own nameservers, and only names the
+        # answering server is authoritative for.
+        targets = {rr.target for rr in ns_rrset}
+        glue_rrsets = [
+            rrset
+            for rrset in response.additional
+            if rrset.rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA)
+            and rrset.name in targets
+            and rrset.name.is_subdomain(current_zone)
+        ]
+        if not glue_rrsets:
+            return
+        ttl = min(min(rrset.ttl for rrset in [ns_rrset, *glue_rrsets]), MAX_CACHE_TTL)
+        if ttl <= 0:
+            return
+        glue_ips = [rr.address for rrset in glue_rrsets for rr in rrset]
+        zone = ns_rrset.name.to_text().lower()
+        with self._deleg_lock:
+            self._deleg_cache[zone] = (glue_ips, time.time() + ttl)
+            self._deleg_cache.move_to_end(zone)
+            while len(self._deleg_cache) > self.max_cache:
+                self._deleg_cache.popitem(last=False)
+
+    def _delegation_forget(self, zone: str) -> None:
+        with self._deleg_lock:
+            self._deleg_cache.pop(zone, None)
 
     # --- Resolution pipeline -------------------------------------------
     def _query_server(
@@ -226,10 +584,63 @@ class ResolverServer:
         else:
             query.flags &= ~dns.flags.RD
         start = time.perf_counter()
-        response = dns.query.udp(query, server_ip, timeout=self.timeout)
+        if self._race_pool is not None:
+            response = self._race_query(query, server_ip)
+        else:
+            response = self._udp_query(query, server_ip)
         rtt = time.perf_counter() - start
         return response, rtt
 
+    def _udp_query(self, query: dns.message.Message, server_ip: str) -> dns.message.Message:
+        sock = self._upstream_socket() if ip_address(server_ip).version == 4 else None
+        # A reused socket may still receive late replies to an earlier query
+        # that timed out; skip those instead of failing this one.
+        return dns.query.udp(
+            query,
+            server_ip,
+            timeout=self.timeout,
+            ignore_unexpected=True,
+            sock=sock,
+            ignore_errors=sock is not None,
+        )
+
+    def _race_query(self, query: dns.message.Message, server_ip: str) -> dns.message.Message:
+        """Send the query over UDP and TCP at once and return the first usable reply.
+
+        A lost UDP datagram then costs a TCP round trip instead of a full
+        timeout. Truncated UDP replies are skipped in favour of the TCP answer.
+        """
+        udp = self._race_pool.submit(self._udp_query, query, server_ip)
+        tcp = self._race_pool.submit(dns.query.tcp, query, server_ip, timeout=self.timeout)
+        pending = {udp, tcp}
+        deadline = time.perf_counter() + self.timeout
+        try:
+            while pending:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        response = future.result()
+                    except (dns.exception.DNSException, OSError):
+                        continue
+                    if future is udp and response.flags & dns.flags.TC:
+                        continue
+                    return response
+        finally:
+            for future in pending:
+                future.cancel()
+        raise dns.exception.Timeout
+
+    def _upstream_socket(self) -> socket.socket:
+        sock = getattr(self._thread_local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self._thread_local.sock = sock
+        return sock
+
     def _step_name(self, depth: int) -> str:
         if depth == 0:
             return "Root"
@@ -244,8 +655,17 @@ class ResolverServer:
         if response.answer:
             return "ANSWER"
         if response.authority:
-            ns_names = ",".join(sorted({rr.to_text() for rrset in response.authority for rr in rrset}))
-            return f"REFERRAL {ns_names}" if ns_names else "REFERRAL"
+            # Only used for the log, so list at most SUMMARY_MAX_NAMES names.
+            names: List[str] = []
+            for rrset in response.authority:
+                for rr in rrset:
+                    target = getattr(rr, "target", None)
+                    names.append(target.to_text() if target is not None else rr.to_text())
+                    if len(names) >= SUMMARY_MAX_NAMES:
+                        break
+                if len(names) >= SUMMARY_MAX_NAMES:
+                    break
+            return f"REFERRAL {','.join(names)}" if names else "REFERRAL"
         return dns.rcode.to_text(rcode)
 
     def _extract_glue_ips(self, response: dns.message.Message) -> List[str]:
@@ -267,33 +687,52 @@ class ResolverServer:
                 names.append(rr.target.to_text())
         return names
 
-    def _resolve_ns_addresses(self, ns_names: Iterable[str]) -> List[str]:
-        resolver = dns.resolver.Resolver(configure=True)
-        resolver.lifetime = self.timeout
-        safe_ns = self._safe_system_nameservers()
-        if safe_ns:
-            resolver.nameservers = list(safe_ns)
+    def _lookup_ns_name(self, ns_name: str) -> Tuple[str, ...]:
+        # NS names such as a.gtld-servers.net recur across referrals; their
+        # answers go through the regular cache, so record TTLs and --no-cache
+        # apply, and empty or failed lookups are never remembered.
+        rrsets = self._cache_lookup(ns_name, dns.rdatatype.A)
+        if rrsets is None:
+            answer = self._upstream.resolve(ns_name, rdtype=dns.rdatatype.A, raise_on_no_answer=False)
+            rrsets = list(answer.response.answer)
+            if any(rrset.rdtype == dns.rdatatype.A for rrset in rrsets):
+                self._cache_store(ns_name, dns.rdatatype.A, rrsets)
         ips: List[str] = []
-        for ns_name in ns_names:
-            try:
-                answer = resolver.resolve(ns_name, rdtype=dns.rdatatype.A, raise_on_no_answer=False)
-            except (dns.resolver.NXDOMAIN, dns.exception.Timeout, dns.resolver.NoNameservers):
+        for rrset in rrsets:
+            if rrset.rdtype != dns.rdatatype.A:
                 continue
-            for rrset in answer.response.answer:
-                if rrset.rdtype != dns.rdatatype.A:
-                    continue
-                for rr in rrset:
-                    address = getattr(rr, "address", rr.to_text())
-                    ips.append(address)
-        return ips
+            for rr in rrset:
+                address = getattr(rr, "address", rr.to_text())
+                ips.append(address)
+        return tuple(ips)
+
+    def _resolve_one_ns(self, ns_name: str) -> Tuple[str, ...]:
+        try:
+            return self._lookup_ns_name(ns_name)
+        except (dns.resolver.NXDOMAIN, dns.exception.Timeout, dns.resolver.NoNameservers):
+            return ()
+
+    def _resolve_ns_addresses(self, ns_names: Iterable[str]) -> List[str]:
+        """Resolve NS names concurrently and return the first non-empty address list."""
+        names = list(dict.fromkeys(ns_names))
+        if len(names) <= 1:
+            return [ip for name in names for ip in self._resolve_one_ns(name)]
+        futures = [self._ns_pool.submit(self._resolve_one_ns, name) for name in names]
+        try:
+            for future in as_completed(futures):
+                ips = future.result()
+                if ips:
+                    return list(ips)
+            return []
+        finally:
+            # Don't wait for the slower lookups; whatever they resolve still
+            # lands in the cache for later referrals.
+            for future in futures:
+                future.cancel()
 
     def _recursive_lookup(self, qname: str, qtype: int) -> Tuple[List[dns.rrset.RRset], int, List[TraceEvent]]:
         """Perform a recursive resolution using the system resolvers (public if needed)."""
-        resolver = dns.resolver.Resolver(configure=True)
-        resolver.lifetime = self.timeout
-        safe_ns = self._safe_system_nameservers()
-        if safe_ns:
-            resolver.nameservers = list(safe_ns)
+        resolver = self._upstream
 
         trace: List[TraceEvent] = []
         start = time.perf_counter()
@@ -346,16 +785,30 @@ class ResolverServer:
         servers: List[str] = list(self.root_servers)
         depth = 0
         last_rcode = dns.rcode.SERVFAIL
+        target = dns.name.from_text(qname)
+        # Zone served by the servers being asked; referrals must descend from it.
+        current_zone = dns.name.root
+
+        # Skip the root (and TLD) steps when a delegation for an enclosing
+        # zone is already known.
+        delegation = self._delegation_lookup(qname)
+        if delegation is not None:
+            deleg_zone, servers = delegation
+            servers = list(servers)
+            depth = min(deleg_zone.count("."), 2)
+            current_zone = dns.name.from_text(deleg_zone)
 
         while servers:
             step_name = self._step_name(depth)
             depth = min(depth + 1, 2)
+            responded = False
             for server in servers:
                 try:
                     response, rtt = self._query_server(server, qname, qtype, recursion_desired)
                 except (dns.exception.Timeout, OSError):
                     continue
 
+                responded = True
                 last_rcode = response.rcode()
                 summary = self._summarize(response)
                 total = time.perf_counter() - start
@@ -376,8 +829,12 @@ class ResolverServer:
                 if last_rcode == dns.rcode.NXDOMAIN:
                     return [], dns.rcode.NXDOMAIN, trace
 
+                referral = self._referral_rrset(target, current_zone, response)
                 glue_ips = self._extract_glue_ips(response)
                 if glue_ips:
+                    if referral is not None:
+                        self._delegation_store(current_zone, referral, response)
+                        current_zone = referral.name
                     servers = glue_ips
                     break
 
@@ -387,15 +844,27 @@ class ResolverServer:
 
                 resolved_ips = self._resolve_ns_addresses(ns_names)
                 if resolved_ips:
+                    if referral is not None:
+                        current_zone = referral.name
                     servers = resolved_ips
                     break
             else:
+                if delegation is not None and not responded:
+                    # The cached nameservers are unreachable; start over from the roots.
+                    self._delegation_forget(delegation[0])
+                    delegation = None
+                    servers = list(self.root_servers)
+                    depth = 0
+                    current_zone = dns.name.root
+                    continue
                 break
+            delegation = None
 
         return [], last_rcode, trace
 
     def resolve(self, qname: str, qtype: int, recursion_requested: bool) -> Tuple[List[dns.rrset.RRset], int, List[TraceEvent], bool]:
-        cached = self._cache_lookup(qname, qtype)
+        # Clients get copies with the TTL counted down to the time left in cache.
+        cached = self._cache_lookup(qname, qtype, adjust_ttl=True)
         if cached is not None:
             event = TraceEvent(
                 server="CACHE",
@@ -408,49 +877,171 @@ class ResolverServer:
             )
             return cached, dns.rcode.NOERROR, [event], True
 
+        if not self.cache_enabled:
+            # Without a cache every query resolves on its own, so the no-cache
+            # baseline is not skewed by shared in-flight results.
+            answers, rcode, trace = self._lookup(qname, qtype, recursion_requested)
+            return answers, rcode, trace, False
+
+        # Single-flight: identical concurrent queries wait for the first one
+        # instead of walking the hierarchy again.
+        key = (*self._cache_key(qname, qtype), recursion_requested)
+        with self._cache_lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = InFlight(threading.Event())
+                self._inflight[key] = flight
+
+        if not leader:
+            start = time.perf_counter()
+            if flight.done.wait(INFLIGHT_WAIT_S) and flight.result is not None:
+                answers, rcode = flight.result
+                waited = time.perf_counter() - start
+                event = TraceEvent(
+                    server="INFLIGHT",
+                    step="INFLIGHT",
+                    response="ANSWER_FROM_INFLIGHT" if answers else dns.rcode.to_text(rcode),
+                    rtt=waited,
+                    total_time=waited,
+                    cache_status="SHARED",
+                    event_time=time.time(),
+                )
+                return answers, rcode, [event], False
+            answers, rcode, trace = self._lookup(qname, qtype, recursion_requested)
+            return answers, rcode, trace, False
+
+        try:
+            answers, rcode, trace = self._lookup(qname, qtype, recursion_requested)
+            flight.result = (answers, rcode)
+            return answers, rcode, trace, False
+        finally:
+            with self._cache_lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def _lookup(self, qname: str, qtype: int, recursion_requested: bool) -> Tuple[List[dns.rrset.RRset], int, List[TraceEvent]]:
         # If recursion is requested, try recursive resolution first.
         if recursion_requested:
             answers, rcode, trace = self._recursive_lookup(qname, qtype)
             if answers and rcode == dns.rcode.NOERROR:
                 self._cache_store(qname, qtype, answers)
-                return answers, rcode, trace, False
+                return answers, rcode, trace
             # fall back to iterative if recursive attempt didn't yield an answer
         answers, rcode, trace = self._iterative_lookup(qname, qtype, recursion_requested)
         if answers and rcode == dns.rcode.NOERROR:
             self._cache_store(qname, qtype, answers)
-        return answers, rcode, trace, False
+        return answers, rcode, trace
 
     # --- Networking layer ---------------------------------------------
     def serve(self) -> None:
         self._socket.bind((self.listen_ip, self.listen_port))
+        self._tcp_socket.bind((self.listen_ip, self.listen_port))
+        self._tcp_socket.listen(128)
+        threading.Thread(target=self._tcp_accept_loop, daemon=True).start()
         print(f"--- Custom resolver running on {self.listen_ip}:{self.listen_port} (cache={'on' if self.cache_enabled else 'off'}, recursive_default={'on' if self.recursive_default else 'off'})")
+        self._workers = [
+            threading.Thread(target=self._worker_loop, daemon=True) for _ in range(self.worker_threads)
+        ]
+        for worker in self._workers:
+            worker.start()
+        receiver: Optional[BatchReceiver] = None
+        if self.batch_recv:
+            if BatchReceiver.available():
+                receiver = BatchReceiver(self._socket)
+            else:
+                print("--- recvmmsg() unavailable; falling back to recvfrom()")
         try:
             while not self._shutdown.is_set():
                 try:
-                    data, addr = self._socket.recvfrom(2048)
+                    if receiver is not None:
+                        batch = receiver.receive()
+                    else:
+                        batch = [self._socket.recvfrom(2048)]
                 except OSError:
                     break
-                threading.Thread(target=self._handle_request, args=(data, addr), daemon=True).start()
+                for data, addr in batch:
+                    self._work_queue.put((data, addr, None))
         finally:
+            for _ in self._workers:
+                self._work_queue.put(None)
             self._socket.close()
+            self._tcp_socket.close()
 
-    def shutdown(self) -> None:
-        self._shutdown.set()
+    def _tcp_accept_loop(self) -> None:
+        while not self._shutdown.is_set():
+            try:
+                conn, addr = self._tcp_socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._tcp_read_loop, args=(conn, addr), daemon=True).start()
+
+    def _tcp_read_loop(self, conn: socket.socket, addr: Tuple[str, int]) -> None:
+        """Queue every length-prefixed query on the connection until EOF or idle timeout."""
+        conn.settimeout(TCP_IDLE_TIMEOUT_S)
+        client = _TcpClient(conn)
+        reader = conn.makefile("rb")
         try:
-            self._socket.close()
+            while not self._shutdown.is_set():
+                header = reader.read(2)
+                if len(header) < 2:
+                    break
+                (length,) = struct.unpack("!H", header)
+                data = reader.read(length)
+                if len(data) < length:
+                    break
+                client.hold()
+                self._work_queue.put((data, addr, client))
         except OSError:
             pass
+        finally:
+            reader.close()
+            client.finish_reading()
+
+    def _worker_loop(self) -> None:
+        while True:
+            item = self._work_queue.get()
+            if item is None:
+                break
+            data, addr, client = item
+            wire = None
+            try:
+                wire = self._handle_request(data)
+            except Exception:
+                # One malformed or failing request must not take down a worker.
+                pass
+            if client is not None:
+                client.reply(wire)
+            elif wire is not None:
+                try:
+                    self._socket.sendto(wire, addr)
+                except OSError:
+                    pass
+
+    def shutdown(self) -> None:
+        self._shutdown.set()
+        for sock in (self._socket, self._tcp_socket):
+            try:
+                sock.close()
+            except OSError:
+                pass
 
-    def _handle_request(self, data: bytes, addr: Tuple[str, int]) -> None:
+    def _handle_request(self, data: bytes) -> Optional[bytes]:
+        """Resolve one query message and return the wire-format reply, or None to drop it."""
+        # Drop truncated or question-less packets from the 12-byte header alone,
+        # before paying for a full parse.
+        if len(data) < 12 or data[4:6] == b"\x00\x00":
+            return None
         try:
             request = dns.message.from_wire(data)
         except Exception:
-            return
+            return None
 
         if not request.question:
-            return
+            return None
 
         question = request.question[0]
+        # Logged as the client sent it; the cache and in-flight keys lowercase it.
         qname = question.name.to_text()
         qtype = question.rdtype
         recursion_requested = bool(request.flags & dns.flags.RD) or self.recursive_default
@@ -481,31 +1072,61 @@ class ResolverServer:
                 event_time=event.event_time,
             ), request_id)
 
-        try:
-            self._socket.sendto(response.to_wire(), addr)
-        except OSError:
-            pass
+        return response.to_wire()
 
     def close(self) -> None:
+        # Let workers finish the requests they hold so their rows reach the
+        # logger before it is closed; bounded by one upstream timeout.
+        deadline = time.monotonic() + self.timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        if self._race_pool is not None:
+            self._race_pool.shutdown(wait=False, cancel_futures=True)
+        self._ns_pool.shutdown(wait=False, cancel_futures=True)
         self.logger.close()
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Custom DNS resolver with logging for CS331 Assignment 2")
     parser.add_argument("--listen", default="10.0.0.5", help="IP address to bind (default: 10.0.0.5)")
-    parser.add_argument("--port", type=int, default=53, help="UDP port to listen on (default: 53)")
+    parser.add_argument("--port", type=int, default=53, help="UDP and TCP port to listen on (default: 53)")
     parser.add_argument("--timeout", type=float, default=3.0, help="Timeout for upstream DNS queries in seconds")
     parser.add_argument("--log", default="logs/dns_iterative.csv", help="CSV log file path")
+    parser.add_argument("--log-flush-interval", type=float, default=0.5, help="Seconds between log flushes; 0 flushes only when the buffer fills or on exit")
     parser.add_argument("--recursive", action="store_true", help="Force recursion even when clients do not request it")
     parser.add_argument("--no-cache", action="store_true", help="Disable the in-memory resolver cache")
+    parser.add_argument("--workers", type=int, default=1, help="Number of resolver processes sharing the listen socket via SO_REUSEPORT")
+    parser.add_argument("--batch-recv", action="store_true", help="Drain client datagrams in batches with recvmmsg() (Linux only)")
+    parser.add_argument("--threads", type=int, default=32, help="Number of worker threads handling client queries")
+    parser.add_argument("--race-transport", action="store_true", help="Query each upstream server over UDP and TCP at once and use the first reply")
+    parser.add_argument("--max-cache", type=int, default=10000, help="Maximum number of cached answers before LRU eviction")
     parser.add_argument("--root-server", action="append", dest="roots", help="Override default root server list (can be provided multiple times)")
     return parser.parse_args()
 
 
+def _spawn_workers(count: int) -> List[int]:
+    """Fork ``count - 1`` extra resolver processes; return child PIDs in the parent."""
+    children: List[int] = []
+    for _ in range(count - 1):
+        pid = os.fork()
+        if pid == 0:
+            return []
+        children.append(pid)
+    return children
+
+
 def main() -> None:
     args = parse_args()
     log_path = Path(args.log)
-    logger = ResolverLogger(log_path)
+    workers = max(1, args.workers)
+
+    children: List[int] = []
+    if workers > 1:
+        # Write the header and fork before any threads exist; each process
+        # then builds its own logger, socket and caches.
+        ResolverLogger.ensure_header(log_path)
+        children = _spawn_workers(workers)
+    logger = ResolverLogger(log_path, flush_interval=args.log_flush_interval)
 
     roots: Sequence[str] = tuple(args.roots) if args.roots else ROOT_SERVERS
 
@@ -517,8 +1138,26 @@ def main() -> None:
         recursive_default=args.recursive,
         logger=logger,
         root_servers=roots,
+        max_cache=args.max_cache,
+        worker_threads=args.threads,
+        race_transport=args.race_transport,
+        reuse_port=workers > 1,
+        batch_recv=args.batch_recv,
     )
 
+    def _terminate(signum, frame):
+        # Shut down once: a repeated SIGTERM must not interrupt the final flush.
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    # main.py stops the resolver with SIGTERM; exit through the finally block
+    # so buffered log rows are flushed. The parent passes it on to workers.
+    signal.signal(signal.SIGTERM, _terminate)
     try:
         server.serve()
     except KeyboardInterrupt:
@@ -526,6 +1165,11 @@ def main() -> None:
     finally:
         server.shutdown()
         server.close()
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
 
 
 if __name__ == "__main__":
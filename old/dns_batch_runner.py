@@ -4,19 +4,28 @@ from __future__ import annotations
 
 import argparse
 import csv
+import functools
+import random
+import selectors
+import socket
+import struct
+import threading
 import time
-from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Iterable, List, Optional, Sequence, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 from ipaddress import ip_address
 
 import dns.exception
-import dns.flags
 import dns.message
-import dns.query
+import dns.name
 import dns.rcode
+import dns.rdataclass
 import dns.rdatatype
 import dns.resolver
+import numpy as np
 
 
 @dataclass
@@ -29,6 +38,9 @@ class QueryResult:
     answers: List[str]
 
 
+_FLAG_VALUES = {"1": True, "true": True, "yes": True, "0": False, "false": False, "no": False}
+
+
 def load_queries(path: Path) -> List[Tuple[str, Optional[bool]]]:
     """Load queries from plain text or tshark CSV with headers.
 
@@ -41,23 +53,29 @@ def load_queries(path: Path) -> List[Tuple[str, Optional[bool]]]:
 
     queries: List[Tuple[str, Optional[bool]]] = []
     if "dns.qry.name" in first:
-        # Parse as CSV
-        import csv as _csv
-        with path.open() as h:
-            reader = _csv.DictReader(h)
-            for row in reader:
-                domain = (row.get("dns.qry.name") or "").strip()
-                if not domain:
-                    continue
-                flag_raw = (row.get("dns.flags.recdesired") or "").strip().lower()
-                if flag_raw in {"1", "true", "yes"}:
-                    recursion_flag = True
-                elif flag_raw in {"0", "false", "no"}:
-                    recursion_flag = False
-                else:
-                    recursion_flag = None
-                queries.append((domain, recursion_flag))
-        return queries
+        # Parse as CSV in one vectorised pass, reading only the columns we use
+        import pandas as pd
+
+        frame = pd.read_csv(
+            path,
+            usecols=lambda column: column in {"dns.qry.name", "dns.flags.recdesired"},
+            dtype=str,
+            na_filter=False,
+        )
+        domains = frame["dns.qry.name"].str.strip()
+        if "dns.flags.recdesired" in frame:
+            flags = (
+                frame["dns.flags.recdesired"]
+                .str.strip()
+                .str.lower()
+                .map(_FLAG_VALUES)
+                .astype(object)
+                .where(lambda values: values.notna(), None)
+            )
+        else:
+            flags = pd.Series([None] * len(frame), dtype=object)
+        keep = (domains != "").to_numpy()
+        return list(zip(domains[keep].tolist(), flags[keep].tolist()))
 
     # Fallback: parse as plain text list
     with path.open() as handle:
@@ -104,6 +122,176 @@ def system_nameservers() -> Sequence[str]:
     return tuple(usable)
 
 
+def _is_ipv4(address: str) -> bool:
+    try:
+        return ip_address(address).version == 4
+    except ValueError:
+        return False
+
+
+@functools.lru_cache(maxsize=4096)
+def _encode_question(domain: str, qtype: int) -> bytes:
+    """Wire-format QNAME + QTYPE + QCLASS(IN), cached per (domain, qtype)."""
+    name = domain.rstrip(".")
+    try:
+        labels = [label.encode("ascii") for label in name.split(".")] if name else []
+    except UnicodeEncodeError:
+        labels = None
+    if labels is None or any(not 0 < len(label) <= 63 for label in labels):
+        # IDN or malformed names: let dnspython encode (or reject) them.
+        qname = dns.name.from_text(domain).to_wire()
+    else:
+        qname = b"".join(bytes([len(label)]) + label for label in labels) + b"\x00"
+    return qname + struct.pack("!HH", qtype, dns.rdataclass.IN)
+
+
+def encode_query(domain: str, qtype: int, rd: bool, qid: int) -> bytes:
+    """Build a single-question DNS query without going through dns.message."""
+    flags = 0x0100 if rd else 0x0000
+    return struct.pack("!HHHHHH", qid, flags, 1, 0, 0, 0) + _encode_question(domain, qtype)
+
+
+def _is_reply(data: bytes, qid: int, question: bytes) -> bool:
+    """Cheap check that `data` answers our query: same ID, QR set, same question."""
+    if len(data) < 12 + len(question) or (data[0] << 8 | data[1]) != qid or not data[2] & 0x80:
+        return False
+    # Compare case-insensitively; label length bytes (< 64) are unaffected by lower().
+    return data[12:12 + len(question)].lower() == question.lower()
+
+
+_ADDRESS_TYPES = frozenset((dns.rdatatype.A, dns.rdatatype.AAAA))
+
+
+def _extract_answers(response: dns.message.Message) -> List[str]:
+    answers: List[str] = []
+    for rrset in response.answer:
+        if rrset.rdtype in _ADDRESS_TYPES:
+            # A/AAAA rdata always carry .address; no getattr fallback needed.
+            answers += [rdata.address for rdata in rrset]
+        else:
+            answers.append(rrset.to_text())
+    return answers
+
+
+# Answers no other server would contradict; anything else keeps the fan-out waiting.
+_DEFINITIVE_RCODES = frozenset((dns.rcode.NOERROR, dns.rcode.NXDOMAIN))
+
+
+def _fan_out_query(
+    wire: bytes,
+    nameservers: Sequence[str],
+    timeout: float,
+    port: int,
+    family: int = socket.AF_INET,
+) -> Optional[Tuple[dns.message.Message, float, str]]:
+    """Send the query to every nameserver at once and wait for the replies.
+
+    Returns (response, elapsed_ms, server) for the first definitive (NOERROR or
+    NXDOMAIN) reply; SERVFAIL, REFUSED and the like only count if no other
+    server does better before the timeout. Returns None if nothing valid arrived.
+    """
+    qid = wire[0] << 8 | wire[1]
+    question = wire[12:]
+    waiting = set(nameservers)
+    first_reply: Optional[Tuple[dns.message.Message, float, str]] = None
+    with socket.socket(family, socket.SOCK_DGRAM) as sock, selectors.DefaultSelector() as selector:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        start = time.perf_counter()
+        for server in nameservers:
+            sock.sendto(wire, (server, port))
+        deadline = start + timeout
+        while waiting:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not selector.select(remaining):
+                break
+            try:
+                data, address = sock.recvfrom(65535)
+            except BlockingIOError:
+                continue
+            source, source_port = address[0], address[1]
+            if source not in waiting or source_port != port or not _is_reply(data, qid, question):
+                continue
+            try:
+                response = dns.message.from_wire(data)
+            except Exception:
+                continue
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            waiting.discard(source)
+            if response.rcode() in _DEFINITIVE_RCODES:
+                return response, elapsed_ms, source
+            if first_reply is None:
+                first_reply = (response, elapsed_ms, source)
+    return first_reply
+
+
+_thread_sockets = threading.local()
+
+
+def _connected_socket(server: str, port: int) -> socket.socket:
+    """This thread's UDP socket connected to (server, port), created on first use.
+
+    connect() fixes the route and peer once, so each query is a bare send/recv
+    and the kernel drops datagrams from any other source.
+    """
+    sockets: Optional[Dict[Tuple[str, int], socket.socket]] = getattr(_thread_sockets, "sockets", None)
+    if sockets is None:
+        sockets = _thread_sockets.sockets = {}
+    sock = sockets.get((server, port))
+    if sock is None:
+        family = socket.AF_INET if _is_ipv4(server) else socket.AF_INET6
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.connect((server, port))
+        except OSError:
+            sock.close()
+            raise
+        sockets[(server, port)] = sock
+    return sock
+
+
+def _connected_query(
+    wire: bytes,
+    server: str,
+    port: int,
+    timeout: float,
+) -> Optional[Tuple[dns.message.Message, float, str]]:
+    """Query a single nameserver over this thread's connected UDP socket.
+
+    Late replies to earlier queries on the same socket fail the ID/question
+    check and are skipped. Returns None on timeout.
+    """
+    qid = wire[0] << 8 | wire[1]
+    question = wire[12:]
+    sock = _connected_socket(server, port)
+    try:
+        start = time.perf_counter()
+        sock.send(wire)
+        deadline = start + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            sock.settimeout(remaining)
+            try:
+                data = sock.recv(65535)
+            except socket.timeout:
+                return None
+            if not _is_reply(data, qid, question):
+                continue
+            try:
+                response = dns.message.from_wire(data)
+            except Exception:
+                continue
+            return response, (time.perf_counter() - start) * 1000.0, server
+    except OSError:
+        # e.g. ICMP port unreachable surfaced on the connected socket; start
+        # the next query on a fresh one.
+        _thread_sockets.sockets.pop((server, port), None)
+        sock.close()
+        raise
+
+
 def perform_query(
     nameservers: Sequence[str],
     domain: str,
@@ -112,33 +300,142 @@ def perform_query(
     timeout: float,
     port: int,
 ) -> Tuple[str, float, List[str], str]:
-    query = dns.message.make_query(domain, qtype)
-    if recursion_desired:
-        query.flags |= dns.flags.RD
-    else:
-        query.flags &= ~dns.flags.RD
+    wire = encode_query(domain, qtype, recursion_desired, random.getrandbits(16))
 
-    last_error: Optional[Exception] = None
+    # A single resolver (the custom mode) reuses one connected socket per thread.
+    if len(nameservers) == 1:
+        server = nameservers[0]
+        try:
+            outcome = _connected_query(wire, server, port, timeout)
+        except OSError:
+            return "ERROR", 0.0, [], server
+        if outcome is None:
+            return "TIMEOUT", 0.0, [], server
+        response, elapsed_ms, _ = outcome
+        return dns.rcode.to_text(response.rcode()), elapsed_ms, _extract_answers(response), server
+
+    # With IPv4 resolvers, query them all in parallel: a dead first server then
+    # costs nothing instead of a full timeout. Otherwise (or if the parallel
+    # send fails at socket level) try the servers one at a time.
+    if nameservers and all(_is_ipv4(ns) for ns in nameservers):
+        try:
+            outcome = _fan_out_query(wire, nameservers, timeout, port)
+        except OSError:
+            pass
+        else:
+            if outcome is None:
+                # Every server was asked and none answered.
+                return "TIMEOUT", 0.0, [], ";".join(nameservers)
+            response, elapsed_ms, server = outcome
+            return dns.rcode.to_text(response.rcode()), elapsed_ms, _extract_answers(response), server
+
+    status = "ERROR"
     for server in nameservers:
+        family = socket.AF_INET if _is_ipv4(server) else socket.AF_INET6
         try:
-            start = time.perf_counter()
-            response = dns.query.udp(query, server, timeout=timeout, port=port)
-            elapsed_ms = (time.perf_counter() - start) * 1000.0
-            status = dns.rcode.to_text(response.rcode())
-            answers: List[str] = []
-            for rrset in response.answer:
-                if rrset.rdtype == dns.rdatatype.A:
-                    answers.extend(getattr(rdata, "address", rdata.to_text()) for rdata in rrset)
-                elif rrset.rdtype == dns.rdatatype.AAAA:
-                    answers.extend(getattr(rdata, "address", rdata.to_text()) for rdata in rrset)
-                else:
-                    answers.append(rrset.to_text())
-            return status, elapsed_ms, answers, server
-        except (dns.exception.Timeout, OSError) as exc:
-            last_error = exc
+            outcome = _fan_out_query(wire, [server], timeout, port, family)
+        except OSError:
+            status = "ERROR"
             continue
-    status = "TIMEOUT" if isinstance(last_error, dns.exception.Timeout) else "ERROR"
-    return status, 0.0, [], nameservers[-1] if nameservers else ""
+        if outcome is None:
+            status = "TIMEOUT"
+            continue
+        response, elapsed_ms, server = outcome
+        return dns.rcode.to_text(response.rcode()), elapsed_ms, _extract_answers(response), server
+    return status, 0.0, [], ";".join(nameservers)
+
+
+class TcpPipeline:
+    """One persistent TCP connection carrying many outstanding queries.
+
+    Queries are written back to back with the RFC 1035 two-byte length prefix;
+    a reader thread matches replies to waiters by query ID, so replies may
+    arrive in any order.
+    """
+
+    def __init__(self, server: str, port: int, timeout: float) -> None:
+        self.server = server
+        self._sock = socket.create_connection((server, port), timeout=timeout)
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send_lock = threading.Lock()
+        self._pending: Dict[int, Tuple[Future, bytes, float]] = {}
+        self._pending_lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _recv_exact(self, size: int) -> bytes:
+        chunks = bytearray()
+        while len(chunks) < size:
+            chunk = self._sock.recv(size - len(chunks))
+            if not chunk:
+                raise ConnectionError("resolver closed the TCP connection")
+            chunks += chunk
+        return bytes(chunks)
+
+    def _read_loop(self) -> None:
+        error: Exception = ConnectionError("TCP pipeline closed")
+        try:
+            while True:
+                (length,) = struct.unpack("!H", self._recv_exact(2))
+                data = self._recv_exact(length)
+                if len(data) < 12:
+                    continue
+                qid = data[0] << 8 | data[1]
+                with self._pending_lock:
+                    entry = self._pending.get(qid)
+                    if entry is None or not _is_reply(data, qid, entry[1]):
+                        continue
+                    del self._pending[qid]
+                future, _, start = entry
+                elapsed_ms = (time.perf_counter() - start) * 1000.0
+                try:
+                    future.set_result((dns.message.from_wire(data), elapsed_ms))
+                except dns.exception.DNSException as exc:  # malformed reply
+                    future.set_exception(exc)
+        except (OSError, struct.error) as exc:
+            error = exc
+        finally:
+            with self._pending_lock:
+                self._closed = True
+                pending, self._pending = self._pending, {}
+            for future, _, _ in pending.values():
+                future.set_exception(error)
+
+    def query(self, domain: str, qtype: int, recursion_desired: bool, timeout: float) -> Tuple[str, float, List[str], str]:
+        future: Future = Future()
+        with self._pending_lock:
+            if self._closed:
+                raise ConnectionError("TCP pipeline closed")
+            qid = random.getrandbits(16)
+            while qid in self._pending:
+                qid = random.getrandbits(16)
+            wire = encode_query(domain, qtype, recursion_desired, qid)
+            self._pending[qid] = (future, wire[12:], time.perf_counter())
+        try:
+            with self._send_lock:
+                self._sock.sendall(struct.pack("!H", len(wire)) + wire)
+            response, elapsed_ms = future.result(timeout)
+        except FutureTimeout:
+            with self._pending_lock:
+                self._pending.pop(qid, None)
+            return "TIMEOUT", 0.0, [], self.server
+        except dns.exception.DNSException:
+            return "ERROR", 0.0, [], self.server
+        except OSError:
+            with self._pending_lock:
+                self._pending.pop(qid, None)
+            raise
+        return dns.rcode.to_text(response.rcode()), elapsed_ms, _extract_answers(response), self.server
+
+    def close(self) -> None:
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._reader.join(timeout=1.0)
 
 
 def write_csv(path: Path, records: Iterable[QueryResult]) -> None:
@@ -168,8 +465,12 @@ def write_summary(
     timeout_failures: int,
     cumulative_latency_ms: float,
     total_duration_s: float,
+    latency_samples: Optional[int] = None,
+    latency_percentiles: Optional[Tuple[float, float, float]] = None,
 ) -> None:
-    avg_latency = (cumulative_latency_ms / successes) if successes else 0.0
+    # Successes served from a deduplicated repeat carry no latency sample.
+    samples = successes if latency_samples is None else latency_samples
+    avg_latency = (cumulative_latency_ms / samples) if samples else 0.0
     throughput = (total / total_duration_s) if total_duration_s > 0 else 0.0
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("w") as handle:
@@ -178,10 +479,15 @@ def write_summary(
         handle.write(f"Failed Resolutions: {failures}\n")
         handle.write(f"Timeout Failures: {timeout_failures}\n")
         handle.write(f"Average Lookup Latency (ms): {avg_latency:.2f}\n")
+        if latency_percentiles is not None:
+            p50, p95, p99 = latency_percentiles
+            handle.write(f"P50 Lookup Latency (ms): {p50:.2f}\n")
+            handle.write(f"P95 Lookup Latency (ms): {p95:.2f}\n")
+            handle.write(f"P99 Lookup Latency (ms): {p99:.2f}\n")
         handle.write(f"Average Throughput (queries/sec): {throughput:.2f}\n")
 
 
-def main() -> None:
+def main(argv: Optional[Sequence[str]] = None) -> None:
     parser = argparse.ArgumentParser(description="DNS batch runner for CS331 assignment")
     parser.add_argument("query_file", type=Path, help="File containing one domain per line")
     parser.add_argument("--mode", choices=("system", "custom"), default="system", help="Resolver target")
@@ -193,7 +499,10 @@ def main() -> None:
     parser.add_argument("--csv-name", help="Filename for the CSV (default derived from mode and query file)")
     parser.add_argument("--summary-name", help="Filename for the summary text file")
     parser.add_argument("--label", help="Optional label used when deriving default filenames")
-    args = parser.parse_args()
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum queries in flight at once (default: 64)")
+    parser.add_argument("--pipeline", action="store_true", help="With a single nameserver, pipeline all queries over one persistent TCP connection")
+    parser.add_argument("--dedupe", action="store_true", help="Resolve each distinct (domain, RD) pair once and reuse the result for repeats")
+    args = parser.parse_args(argv)
 
     queries = load_queries(args.query_file)
     if not queries:
@@ -225,52 +534,103 @@ def main() -> None:
     # Informational print to help diagnose TIMEOUTs inside Mininet namespaces
     print(f"[dns_batch_runner] Mode={args.mode} Using nameservers={list(target_nameservers)} Timeout={args.timeout}s Port={args.port}")
 
-    results: List[QueryResult] = []
     total_queries = len(queries)
-    success_count = 0
-    failure_count = 0
-    timeout_failures = 0
-    cumulative_latency = 0.0
 
-    start_batch = time.perf_counter()
-
-    for domain, line_flag in queries:
+    def _recursion_for(line_flag: Optional[bool]) -> bool:
         if args.recursion == "on":
-            recursion_desired = True
-        elif args.recursion == "off":
-            recursion_desired = False
+            return True
+        if args.recursion == "off":
+            return False
+        return line_flag if line_flag is not None else default_recursion
+
+    pipeline: Optional[TcpPipeline] = None
+    if args.pipeline:
+        if len(target_nameservers) != 1:
+            print("[dns_batch_runner] --pipeline needs exactly one nameserver; using UDP")
         else:
-            recursion_desired = line_flag if line_flag is not None else default_recursion
-
-        status, latency_ms, answers, resolver_ip = perform_query(
-            nameservers=target_nameservers,
-            domain=domain,
-            qtype=dns.rdatatype.A,
-            recursion_desired=recursion_desired,
-            timeout=args.timeout,
-            port=args.port,
-        )
-
-        if status == "NOERROR" and answers:
-            success_count += 1
-            cumulative_latency += latency_ms
-        else:
-            failure_count += 1
-            if status == "TIMEOUT":
-                timeout_failures += 1
-
-        results.append(
-            QueryResult(
+            try:
+                pipeline = TcpPipeline(target_nameservers[0], args.port, args.timeout)
+            except OSError as exc:
+                print(f"[dns_batch_runner] TCP connect to {target_nameservers[0]} failed ({exc}); using UDP")
+
+    def _run_one(idx: int, domain: str, recursion_desired: bool) -> Tuple[int, QueryResult]:
+        outcome = None
+        if pipeline is not None:
+            try:
+                outcome = pipeline.query(domain, dns.rdatatype.A, recursion_desired, args.timeout)
+            except OSError:
+                # Connection dropped by the resolver: finish this query over UDP.
+                outcome = None
+        if outcome is None:
+            outcome = perform_query(
+                nameservers=target_nameservers,
                 domain=domain,
-                status=status,
-                latency_ms=latency_ms,
-                resolver_ip=resolver_ip,
+                qtype=dns.rdatatype.A,
                 recursion_desired=recursion_desired,
-                answers=answers,
+                timeout=args.timeout,
+                port=args.port,
             )
+        status, latency_ms, answers, resolver_ip = outcome
+        return idx, QueryResult(
+            domain=domain,
+            status=status,
+            latency_ms=latency_ms,
+            resolver_ip=resolver_ip,
+            recursion_desired=recursion_desired,
+            answers=answers,
         )
 
+    planned = [(domain, _recursion_for(line_flag)) for domain, line_flag in queries]
+    # With --dedupe only the first occurrence of each (domain, RD) pair goes
+    # on the wire; repeats reuse its result with zero latency.
+    first_index: Dict[Tuple[str, bool], int] = {}
+    duplicates: List[int] = []
+    to_send: List[int] = []
+    for idx, key in enumerate(planned):
+        if args.dedupe and key in first_index:
+            duplicates.append(idx)
+            continue
+        first_index.setdefault(key, idx)
+        to_send.append(idx)
+
+    # Each query is dominated by its network round trip, so keep many in
+    # flight; results are slotted back into input order as they complete.
+    results: List[Optional[QueryResult]] = [None] * total_queries
+    start_batch = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        futures = [executor.submit(_run_one, idx, *planned[idx]) for idx in to_send]
+        for future in as_completed(futures):
+            idx, result = future.result()
+            results[idx] = result
     total_duration = time.perf_counter() - start_batch
+    if pipeline is not None:
+        pipeline.close()
+    for idx in duplicates:
+        results[idx] = replace(results[first_index[planned[idx]]], latency_ms=0.0)
+
+    # Aggregate once, after every query has finished, with NumPy reductions.
+    statuses = [result.status for result in results]
+    succeeded = np.fromiter(
+        (status == "NOERROR" and bool(result.answers) for status, result in zip(statuses, results)),
+        dtype=bool,
+        count=total_queries,
+    )
+    timed_out = np.fromiter((status == "TIMEOUT" for status in statuses), dtype=bool, count=total_queries)
+    latencies = np.fromiter((result.latency_ms for result in results), dtype=np.float64, count=total_queries)
+    sampled = succeeded.copy()
+    sampled[duplicates] = False
+    sample_latencies = latencies[sampled]
+
+    success_count = int(succeeded.sum())
+    failure_count = total_queries - success_count
+    timeout_failures = int(timed_out.sum())
+    cumulative_latency = float(sample_latencies.sum())
+    latency_samples = int(sample_latencies.size)
+    percentiles = (
+        tuple(float(value) for value in np.percentile(sample_latencies, [50, 95, 99]))
+        if latency_samples
+        else None
+    )
 
     write_csv(csv_path, results)
     write_summary(
@@ -281,6 +641,8 @@ def main() -> None:
         timeout_failures=timeout_failures,
         cumulative_latency_ms=cumulative_latency,
         total_duration_s=total_duration,
+        latency_samples=latency_samples,
+        latency_percentiles=percentiles,
     )
 
 
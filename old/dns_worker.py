@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Long-lived batch worker: runs dns_batch_runner batches sent over stdin.
+
+Each request is one JSON line, either ``{"args": [...]}`` holding the
+dns_batch_runner command-line arguments or ``{"cmd": "exit"}``. Every batch
+is answered with one JSON line ``{"ok": bool, "output": str}`` on stdout,
+which carries nothing else, so the interpreter, imports and module-level
+caches stay warm between batches.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import json
+import os
+import sys
+from typing import Dict
+
+import dns_batch_runner
+
+
+def handle(request: Dict[str, object]) -> Dict[str, object]:
+    buffer = io.StringIO()
+    ok = True
+    with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(buffer):
+        try:
+            dns_batch_runner.main([str(token) for token in request.get("args", [])])
+        except SystemExit as exc:
+            # argparse errors and "no queries" both exit; report instead of dying.
+            if exc.code not in (None, 0):
+                ok = False
+                if not isinstance(exc.code, int):
+                    print(exc.code)
+        except Exception as exc:
+            ok = False
+            print(f"[dns_worker] batch failed: {exc!r}")
+    return {"ok": ok, "output": buffer.getvalue()}
+
+
+def main() -> None:
+    # Keep the reply channel private: replies go to a duplicate of the original
+    # stdout, and fd 1 (plus sys.stdout) now points at stderr, so stray prints
+    # or C-level writes cannot corrupt the JSON lines main.py reads.
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as exc:
+            reply: Dict[str, object] = {"ok": False, "output": f"[dns_worker] bad request: {exc}"}
+        else:
+            if request.get("cmd") == "exit":
+                break
+            reply = handle(request)
+        replies.write(json.dumps(reply) + "\n")
+        replies.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 import argparse
-import shlex
+import json
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from subprocess import STDOUT
+from subprocess import PIPE, STDOUT, TimeoutExpired
 
 from mininet.link import TCLink
 from mininet.log import setLogLevel
 from mininet.net import Mininet
 
-from topology import ImageTopo
+from topology import LINK_SHAPING, ImageTopo
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 QUERY_MAP = {
@@ -20,43 +23,166 @@ QUERY_MAP = {
 }
 CLIENT_HOSTS = ("h1", "h2", "h3", "h4")
 
+# Upper bound on one host's batch before it is killed (seconds).
+BATCH_TIMEOUT_S = 3600.0
+
+# Scripts are launched as argv lists with cwd=PROJECT_ROOT, so no shell is involved.
+BATCH_SCRIPT = str(PROJECT_ROOT / "src" / "dns_batch_runner.py")
+RESOLVER_SCRIPT = str(PROJECT_ROOT / "src" / "custom_resolver.py")
+
 
 def _attach_nat(net, switch_name, gateway_ip):
     nat = net.addNAT(name="nat0", connect=False, inNamespace=False, ip=f"{gateway_ip}/24")
-    net.addLink(nat, net.get(switch_name), bw=100, delay="1ms")
+    net.addLink(nat, net.get(switch_name), bw=100, delay="1ms", **LINK_SHAPING)
     return nat
 
 
-def _configure_routes(net, gateway_ip):
-    for host_name in (*CLIENT_HOSTS, "dns"):
-        host = net.get(host_name)
+def _configure_routes(hosts, gateway_ip):
+    for host in hosts.values():
         host.cmd(f"ip route add default via {gateway_ip}")
 
 
-def _python_command(script, *args):
-    """Construct a python3 command line with proper quoting."""
-    quoted = " ".join(shlex.quote(str(token)) for token in (script, *args))
-    return f"python3 {quoted}"
+def _populate_arp(hosts):
+    """Static ARP for the client <-> dns pairs only, instead of every host pair."""
+    dns = hosts["dns"]
+    for name in CLIENT_HOSTS:
+        client = hosts[name]
+        client.setARP(dns.IP(), dns.MAC())
+        dns.setARP(client.IP(), client.MAC())
 
 
-def run_batch(host, query_file, mode, output_dir, label, recursion, timeout, resolver_ip, resolver_port):
-    script = PROJECT_ROOT / "src" / "dns_batch_runner.py"
-    args = [str(query_file), "--mode", mode, "--output-dir", str(output_dir), "--label", label, "--recursion", recursion, "--timeout", str(timeout), "--csv-name", f"{label}_{mode}_results.csv", "--summary-name", f"{label}_{mode}_summary.txt"]
+def _batch_args(query_file, mode, output_dir, label, recursion, timeout, resolver_ip, resolver_port, concurrency=64):
+    args = [str(query_file), "--mode", mode, "--output-dir", str(output_dir), "--label", label, "--recursion", recursion, "--timeout", str(timeout), "--concurrency", str(concurrency), "--csv-name", f"{label}_{mode}_results.csv", "--summary-name", f"{label}_{mode}_summary.txt"]
     if mode == "custom" and resolver_ip:
         args.extend(["--nameserver", resolver_ip, "--port", str(resolver_port)])
-    command = _python_command(script, *args)
-    full = f"cd {shlex.quote(str(PROJECT_ROOT))} && {command}"
-    output = host.cmd(full)
-    if output:
-        print(output)
+    return args
+
+
+class HostWorker:
+    """A dns_worker.py process on one client host, reused for every batch it runs.
+
+    stdout carries only the worker's JSON replies and is drained by a reader
+    thread; stderr has its own pipe. Anything that is not a reply (tracebacks,
+    warnings) is kept and returned with the next batch's output.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        script = PROJECT_ROOT / "src" / "dns_worker.py"
+        self.proc = host.popen(["python3", "-u", str(script)], cwd=str(PROJECT_ROOT), stdin=PIPE, stdout=PIPE, stderr=PIPE, text=True)
+        self.alive = True
+        self._replies = queue.SimpleQueue()
+        self._notes = []
+        self._notes_lock = threading.Lock()
+        threading.Thread(target=self._read_replies, daemon=True).start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+    def _read_replies(self):
+        for line in self.proc.stdout:
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                reply = None
+            if isinstance(reply, dict):
+                self._replies.put(reply)
+            else:
+                self._note(line)
+        # EOF: the worker exited.
+        self._replies.put(None)
+
+    def _read_stderr(self):
+        for line in self.proc.stderr:
+            self._note(line)
+
+    def _note(self, line):
+        with self._notes_lock:
+            self._notes.append(line)
+
+    def _take_notes(self):
+        with self._notes_lock:
+            notes, self._notes = "".join(self._notes), []
+        return notes
+
+    def run(self, label, args, timeout=BATCH_TIMEOUT_S):
+        """Send one batch and return its captured output.
+
+        A batch with no reply after ``timeout`` seconds kills the worker, as
+        run_batches does for a hung dns_batch_runner process.
+        """
+        try:
+            self.proc.stdin.write(json.dumps({"args": args}) + "\n")
+            self.proc.stdin.flush()
+        except OSError:
+            reply = None
+        else:
+            try:
+                reply = self._replies.get(timeout=timeout)
+            except queue.Empty:
+                self.alive = False
+                self.proc.kill()
+                self.proc.wait()
+                return f"{self._take_notes()}[{label}] host worker killed after {timeout:.0f}s\n"
+        if reply is None:
+            self.alive = False
+            return f"{self._take_notes()}[{label}] host worker exited unexpectedly\n"
+        output = reply.get("output", "") + self._take_notes()
+        if not reply.get("ok", False):
+            output += f"[{label}] batch failed on host worker\n"
+        return output
+
+    def stop(self):
+        try:
+            self.proc.stdin.write(json.dumps({"cmd": "exit"}) + "\n")
+            self.proc.stdin.close()
+            self.proc.wait(timeout=3)
+        except Exception:
+            self.proc.kill()
+
+
+def run_batch(host, query_file, mode, output_dir, label, recursion, timeout, resolver_ip, resolver_port, concurrency=64):
+    args = _batch_args(query_file, mode, output_dir, label, recursion, timeout, resolver_ip, resolver_port, concurrency)
+    return host.popen(["python3", BATCH_SCRIPT, *args], cwd=str(PROJECT_ROOT), stdout=PIPE, stderr=STDOUT, text=True)
+
+
+def run_batches(batches, workers=None):
+    """Run several run_batch calls at once and print their output in order.
+
+    Each entry of ``batches`` is a dict of run_batch keyword arguments; the
+    hosts are independent namespaces, so their batches proceed in parallel.
+    Hosts with a live entry in ``workers`` use their HostWorker instead of a
+    fresh interpreter.
+    """
+    workers = workers or {}
+
+    def _run(kwargs):
+        worker = workers.get(kwargs["host"].name)
+        if worker is not None and worker.alive:
+            args = _batch_args(**{key: value for key, value in kwargs.items() if key != "host"})
+            return worker.run(kwargs["label"], args)
+        proc = run_batch(**kwargs)
+        try:
+            output, _ = proc.communicate(timeout=BATCH_TIMEOUT_S)
+        except TimeoutExpired:
+            proc.kill()
+            output, _ = proc.communicate()
+            return f"{output or ''}[{kwargs['label']}] dns_batch_runner killed after {BATCH_TIMEOUT_S:.0f}s\n"
+        if proc.returncode != 0:
+            output = f"{output or ''}[{kwargs['label']}] dns_batch_runner exited with status {proc.returncode}\n"
+        return output
+
+    with ThreadPoolExecutor(max_workers=max(1, len(batches))) as executor:
+        outputs = list(executor.map(_run, batches))
+    for output in outputs:
+        if output:
+            print(output)
 
 
 def configure_host_dns(host, resolver_ip):
     """"Point the host's /etc/resolv.conf to the given resolver IP, backing up the original."""
     # h1 sh -c "echo 'nameserver 8.8.8.8' > /etc/resolv.conf"
     backup_path = f"/tmp/resolv.conf.{host.name}.bak"
-    host.cmd(f"cp /etc/resolv.conf {backup_path}")
-    host.cmd(f"printf 'nameserver {resolver_ip}\n' > /etc/resolv.conf")
+    # One round trip through the host's shell instead of two.
+    host.cmd(f"cp /etc/resolv.conf {backup_path}; printf 'nameserver {resolver_ip}\n' > /etc/resolv.conf")
     return backup_path
 
 
@@ -64,18 +190,19 @@ def restore_host_dns(host, backup_path):
     host.cmd(f"test -f {backup_path} && cat {backup_path} > /etc/resolv.conf && rm -f {backup_path}")
 
 
-def start_resolver(dns_host, resolver_ip, resolver_port, timeout, log_path, recursive, cache_enabled, stdout_log):
-    script = PROJECT_ROOT / "src" / "custom_resolver.py"
+def start_resolver(dns_host, resolver_ip, resolver_port, timeout, log_path, recursive, cache_enabled, stdout_log, race_transport=False, workers=1):
     args = ["--listen", resolver_ip, "--port", str(resolver_port), "--timeout", str(timeout), "--log", str(log_path)]
     if recursive:
         args.append("--recursive")
     if not cache_enabled:
         args.append("--no-cache")
-    resolver_cmd = _python_command(script, *args)
-    full_cmd = f"cd {shlex.quote(str(PROJECT_ROOT))} && {resolver_cmd}"
+    if race_transport:
+        args.append("--race-transport")
+    if workers > 1:
+        args.extend(["--workers", str(workers)])
     stdout_log.parent.mkdir(parents=True, exist_ok=True)
     log_handle = stdout_log.open("w")
-    proc = dns_host.popen(full_cmd, shell=True, stdout=log_handle, stderr=STDOUT)
+    proc = dns_host.popen(["python3", RESOLVER_SCRIPT, *args], cwd=str(PROJECT_ROOT), stdout=log_handle, stderr=STDOUT)
     time.sleep(1.5)
     return proc, log_handle
 
@@ -91,14 +218,15 @@ def stop_resolver(proc, log_handle) :
     log_handle.close()
 
 
-def run_system_baseline(net: Mininet, args):
+def run_system_baseline(hosts, args, workers=None):
     output_dir = args.results_root / "system"
     output_dir.mkdir(parents=True, exist_ok=True)
+    batches = []
     for host_name in CLIENT_HOSTS:
-        host = net.get(host_name)
+        host = hosts[host_name]
         query_path = QUERY_MAP[host_name]
         print(f"[system] Running queries for {host_name} from {query_path.name}")
-        run_batch(
+        batches.append(dict(
             host=host,
             query_file=query_path,
             mode="system",
@@ -108,11 +236,13 @@ def run_system_baseline(net: Mininet, args):
             timeout=args.timeout,
             resolver_ip=None,
             resolver_port=args.resolver_port,
-        )
+            concurrency=args.concurrency,
+        ))
+    run_batches(batches, workers)
 
 
-def run_custom_phase(net: Mininet, args, recursive):
-    dns_host = net.get("dns")
+def run_custom_phase(hosts, args, recursive, workers=None):
+    dns_host = hosts["dns"]
     caches_enabled = not args.no_cache
     phase_name = "custom_recursive" if recursive else "custom_iterative"
     output_dir = args.results_root / phase_name
@@ -129,20 +259,23 @@ def run_custom_phase(net: Mininet, args, recursive):
         recursive=recursive,
         cache_enabled=caches_enabled,
         stdout_log=stdout_log,
+        race_transport=args.race_transport,
+        workers=args.resolver_workers,
     )
 
     backups = {}
     try:
         for host_name in CLIENT_HOSTS:
-            host = net.get(host_name)
+            host = hosts[host_name]
             backups[host_name] = configure_host_dns(host, args.resolver_ip)
 
         recursion_mode = "on" if recursive else "off"
+        batches = []
         for host_name in CLIENT_HOSTS:
-            host = net.get(host_name)
+            host = hosts[host_name]
             query_path = QUERY_MAP[host_name]
             print(f"[{phase_name}] Running queries for {host_name} ({'recursive' if recursive else 'iterative'})")
-            run_batch(
+            batches.append(dict(
                 host=host,
                 query_file=query_path,
                 mode="custom",
@@ -152,16 +285,18 @@ def run_custom_phase(net: Mininet, args, recursive):
                 timeout=args.timeout,
                 resolver_ip=args.resolver_ip,
                 resolver_port=args.resolver_port,
-            )
+                concurrency=args.concurrency,
+            ))
+        run_batches(batches, workers)
     finally:
         for host_name, backup_path in backups.items():
-            restore_host_dns(net.get(host_name), backup_path)
+            restore_host_dns(hosts[host_name], backup_path)
         stop_resolver(resolver_proc, log_handle)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Automate DNS experiments for CS331 Assignment 2")
-    parser.add_argument("phase", choices=("system-baseline", "custom-iterative", "custom-recursive"), help="Experiment phase to execute")
+    parser.add_argument("phases", nargs="+", metavar="phase", choices=("system-baseline", "custom-iterative", "custom-recursive"), help="Experiment phase(s) to execute, in order; several phases share one topology and host workers")
     parser.add_argument("--with-nat", action="store_true", help="Attach a NAT for external connectivity")
     parser.add_argument("--gateway-ip", default="10.0.0.254", help="Gateway IP presented by NAT (default: 10.0.0.254)")
     parser.add_argument("--resolver-ip", default="10.0.0.5", help="IP address of the custom resolver host")
@@ -169,6 +304,11 @@ def parse_args():
     parser.add_argument("--timeout", type=float, default=2.0, help="Per-query timeout in seconds")
     parser.add_argument("--results-root", type=Path, default=PROJECT_ROOT / "results", help="Directory for experiment outputs")
     parser.add_argument("--log-dir", type=Path, default=PROJECT_ROOT / "logs", help="Directory for resolver logs")
+    parser.add_argument("--concurrency", type=int, default=64, help="Queries each host keeps in flight (passed to dns_batch_runner)")
+    parser.add_argument("--persistent-workers", action="store_true", help="Start one long-lived batch worker per client host right after net.start(), reused by every phase")
+    parser.add_argument("--resolver-workers", type=int, default=1, help="Custom resolver processes sharing port 53 via SO_REUSEPORT (default: 1)")
+    parser.add_argument("--race-transport", action="store_true", help="Have the custom resolver race UDP and TCP for every upstream query")
+    parser.add_argument("--skip-pingall", action="store_true", help="Skip the connectivity ping check after net.start()")
     parser.add_argument("--no-cache", action="store_true", help="Disable resolver cache for custom phases")
     return parser.parse_args()
 
@@ -183,7 +323,7 @@ def main() -> None:
         link=TCLink,
         controller=None,
         autoSetMacs=True,
-        autoStaticArp=True,
+        autoStaticArp=False,
     )
 
     nat = None
@@ -192,25 +332,39 @@ def main() -> None:
 
     print("*** Starting topology for automation")
     net.start()
+    # Resolve node handles once; every phase helper takes this mapping.
+    hosts = {name: net.get(name) for name in (*CLIENT_HOSTS, "dns")}
+    _populate_arp(hosts)
 
     if args.with_nat and nat is not None:
         nat.configDefault()
-        _configure_routes(net, args.gateway_ip)
+        _configure_routes(hosts, args.gateway_ip)
 
-    print("*** Validating connectivity (pingAll)")
-    net.pingAll()
+    # Started before the ping check so interpreter startup and imports overlap with it.
+    workers = {}
+    if args.persistent_workers:
+        workers = {host_name: HostWorker(hosts[host_name]) for host_name in CLIENT_HOSTS}
+
+    if not args.skip_pingall:
+        # Only the client <-> resolver paths matter here, not the full host mesh.
+        print("*** Validating connectivity (clients <-> dns)")
+        for host_name in CLIENT_HOSTS:
+            net.ping([hosts[host_name], hosts["dns"]], timeout="0.5")
 
     try:
-        if args.phase == "system-baseline":
-            run_system_baseline(net, args)
-        elif args.phase == "custom-iterative":
-            run_custom_phase(net, args, recursive=False)
-        elif args.phase == "custom-recursive":
-            run_custom_phase(net, args, recursive=True)
-        else:
-            raise ValueError(f"Unknown experiment phase: {args.phase}")
+        for phase in args.phases:
+            if phase == "system-baseline":
+                run_system_baseline(hosts, args, workers)
+            elif phase == "custom-iterative":
+                run_custom_phase(hosts, args, recursive=False, workers=workers)
+            elif phase == "custom-recursive":
+                run_custom_phase(hosts, args, recursive=True, workers=workers)
+            else:
+                raise ValueError(f"Unknown experiment phase: {phase}")
 
     finally:
+        for worker in workers.values():
+            worker.stop()
         print("*** Stopping topology")
         if nat is not None:
             nat.deleteIntfs()
@@ -5,12 +5,46 @@ from __future__ import annotations
 
 import argparse
 from pathlib import Path
-import csv
-from typing import List, Optional, Sequence, Tuple
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+import matplotlib
+
+# Headless rendering: skip GUI backend discovery and initialisation.
+matplotlib.use("Agg")
 
 import matplotlib.pyplot as plt
 import pandas as pd
 
+# Timestamp format written by custom_resolver.ResolverLogger.
+LOG_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# server_contacted values that are not upstream servers.
+NON_SERVER_ENTRIES = ("CACHE", "INFLIGHT")
+# Repetitive string columns read as categoricals: comparisons and groupbys
+# then work on integer codes.
+CATEGORY_COLUMNS = {"domain": "category", "server_contacted": "category", "request_id": "category"}
+
+
+def _read_first_column(path: Path, limit: int, **read_kwargs) -> List[str]:
+    """Collect up to ``limit`` non-blank values of the first selected column.
+
+    Reads in ``limit``-row chunks so the C parser stops shortly after enough
+    names have been seen, even when some rows are blank.
+    """
+    domains: List[str] = []
+    if limit <= 0:
+        return domains
+    try:
+        chunks = pd.read_csv(path, dtype=str, chunksize=limit, **read_kwargs)
+        for chunk in chunks:
+            names = chunk.iloc[:, 0].dropna().str.strip()
+            domains.extend(names[names != ""].tolist())
+            if len(domains) >= limit:
+                break
+    except pd.errors.EmptyDataError:
+        return []
+    return domains[:limit]
+
 
 def load_query_sequence(path: Path, limit: int) -> List[str]:
     """Load first N domains from a plain text list or tshark CSV.
@@ -18,70 +52,60 @@ def load_query_sequence(path: Path, limit: int) -> List[str]:
     - Plain text: one domain per line, comments with '#'
     - CSV: must contain a 'dns.qry.name' header column
     """
-    domains: List[str] = []
     # Peek the first line for header detection
-    first_line = path.read_text().splitlines()[0] if path.exists() else ""
+    first_line = ""
+    if path.exists():
+        with path.open() as handle:
+            first_line = handle.readline()
     if "dns.qry.name" in first_line:
-        with path.open(newline="") as handle:
-            reader = csv.DictReader(handle)
-            for row in reader:
-                name = (row.get("dns.qry.name") or "").strip()
-                if not name:
-                    continue
-                domains.append(name)
-                if len(domains) >= limit:
-                    break
-        return domains
-
-    with path.open() as handle:
-        for line in handle:
-            stripped = line.strip()
-            if not stripped or stripped.startswith("#"):
-                continue
-            domain = stripped.split(",", 1)[0].strip()
-            domains.append(domain)
-            if len(domains) >= limit:
-                break
-    return domains
+        return _read_first_column(path, limit, usecols=["dns.qry.name"])
+    return _read_first_column(path, limit, header=None, usecols=[0], comment="#", skip_blank_lines=True)
 
 
 def select_request_ids(df: pd.DataFrame, domains: Sequence[str]) -> List[Tuple[str, str]]:
     if df.empty:
         return []
-    df = df.copy()
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    df = df.sort_values("timestamp")
+    # main() parses timestamps at load time; only convert frames that weren't.
+    if not pd.api.types.is_datetime64_any_dtype(df["timestamp"]):
+        df = df.assign(timestamp=pd.to_datetime(df["timestamp"], errors="coerce"))
+    df = df.sort_values("timestamp", kind="stable")
+
+    # One pass: each domain's request ids in time order, consumed left to right
+    # so repeated domains pick successive requests.
+    firsts = df.drop_duplicates("request_id")
+    ids_by_domain: Dict[str, Deque[str]] = {}
+    for domain, req_id in zip(firsts["domain"], firsts["request_id"]):
+        ids_by_domain.setdefault(domain, deque()).append(req_id)
 
     selected: List[Tuple[str, str]] = []
-    used_ids: set[str] = set()
     for domain in domains:
-        matches = df[(df["domain"] == domain) & (~df["request_id"].isin(used_ids))]
-        if matches.empty:
+        pending = ids_by_domain.get(domain)
+        if not pending:
             continue
-        req_id = matches.iloc[0]["request_id"]
-        used_ids.add(req_id)
-        selected.append((domain, req_id))
+        selected.append((domain, pending.popleft()))
     return selected
 
 
 def build_metrics(df: pd.DataFrame, domain_requests: Sequence[Tuple[str, str]]) -> pd.DataFrame:
-    rows = []
-    for domain, req_id in domain_requests:
-        group = df[df["request_id"] == req_id]
-        if group.empty:
-            continue
-        non_cache = group[group["server_contacted"] != "CACHE"]
-        servers_visited = len(non_cache["server_contacted"].unique())
-        latency = group["total_time_s"].max() or 0.0
-        rows.append({
-            "domain": domain,
-            "servers_visited": servers_visited,
-            "latency_ms": latency * 1000.0,
-        })
-    return pd.DataFrame(rows)
-
-
-def plot_metrics(df: pd.DataFrame, title: str, output_path: Path) -> None:
+    req_ids = [req_id for _, req_id in domain_requests]
+    subset = df[df["request_id"].isin(req_ids)]
+    # Blank out cache/in-flight rows so nunique() only counts real servers.
+    servers = subset["server_contacted"].where(~subset["server_contacted"].isin(NON_SERVER_ENTRIES))
+    agg = subset.assign(server=servers).groupby("request_id", observed=True).agg(
+        servers_visited=("server", "nunique"),
+        latency_s=("total_time_s", "max"),
+    )
+
+    found = [(domain, req_id) for domain, req_id in domain_requests if req_id in agg.index]
+    ordered = agg.reindex([req_id for _, req_id in found])
+    return pd.DataFrame({
+        "domain": [domain for domain, _ in found],
+        "servers_visited": ordered["servers_visited"].to_numpy(),
+        "latency_ms": ordered["latency_s"].fillna(0.0).to_numpy() * 1000.0,
+    })
+
+
+def plot_metrics(df: pd.DataFrame, title: str, output_path: Path, dpi: int = 150) -> None:
     if df.empty:
         raise SystemExit("No matching resolver events found for the requested domains")
 
@@ -104,7 +128,8 @@ def plot_metrics(df: pd.DataFrame, title: str, output_path: Path) -> None:
     axes[1].set_xticklabels(x_labels, rotation=45, ha="right", fontsize=8)
 
     fig.suptitle(title)
-    plt.savefig(output_path, dpi=200)
+    # The format follows the suffix, so an .svg output skips rasterising.
+    fig.savefig(output_path, dpi=dpi)
     plt.close(fig)
 
 
@@ -118,15 +143,21 @@ def main() -> None:
         "--output",
         type=Path,
         default=Path("results/plots/h1_first10_metrics.png"),
-        help="Output PNG path",
+        help="Output image path (PNG by default; .svg writes a vector figure)",
     )
+    parser.add_argument("--dpi", type=int, default=150, help="Raster resolution for PNG output (default: 150)")
     args = parser.parse_args()
 
-    df = pd.read_csv(args.log_file)
+    df = pd.read_csv(
+        args.log_file,
+        parse_dates=["timestamp"],
+        date_format=LOG_TIMESTAMP_FORMAT,
+        dtype=CATEGORY_COLUMNS,
+    )
     domains = load_query_sequence(args.query_file, args.limit)
     selections = select_request_ids(df, domains)
     metrics = build_metrics(df, selections)
-    plot_metrics(metrics, args.title, args.output)
+    plot_metrics(metrics, args.title, args.output, dpi=args.dpi)
 
 
 if __name__ == "__main__":
@@ -14,6 +14,7 @@ Commands:
   custom-iterative [args...]    Run Task D (iterative custom resolver)
   custom-recursive [args...]    Run Task E (recursive custom resolver)
   custom-iterative-nocache      Run Task F comparison with cache disabled
+  all [args...]                 Run Tasks B, D and E in one topology, reusing per-host batch workers
   clean                         Remove stale Mininet state (mn -c)
 
 All commands except 'setup' and 'clean' accept the same optional arguments
@@ -59,6 +60,10 @@ case "$cmd" in
   custom-iterative-nocache)
     run_phase "custom-iterative" --with-nat --no-cache "$@"
     ;;
+  all)
+    require_root "all"
+    ${PYTHON_BIN} "${ROOT_DIR}/src/main.py" system-baseline custom-iterative custom-recursive --with-nat --persistent-workers "$@"
+    ;;
   clean)
     require_root "clean"
     mn -c || true
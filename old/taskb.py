@@ -1,77 +1,141 @@
 #!/usr/bin/env python3
 import argparse
-import os, csv, time
+import asyncio
+import functools
+import csv, time
 import socket
+from collections import deque
 from ipaddress import ip_address
 from pathlib import Path
+import dns.asyncbackend
+import dns.asyncquery
 import dns.flags
 import dns.message
 import dns.query
 import dns.rcode
 import dns.rdatatype
+import numpy as np
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pac
+except ImportError:  # optional: fall back to the csv module
+    pa = pc = pac = None
+
+_ROOT = Path(__file__).resolve().parent
 
 def query_file(label):
-    root = Path(__file__).resolve().parent
-    return root / "pcap_queries" / f"{label}_queries.csv"
+    return _ROOT / "pcap_queries" / f"{label}_queries.csv"
 
-def load_queries(path):
-    with open(path, "r", encoding="utf-8", errors="ignore") as h:
-        reader = csv.DictReader(h)
-        return [r["dns.qry.name"].strip() for r in reader if r.get("dns.qry.name")]
+def _col(header, name):
+    return header.index(name) if name in header else None
 
-def pcap_stats(path: Path):
-    total_bytes = 0
-    t_first = None
-    t_last = None
+def _cell(row, i):
+    return row[i] if i is not None and i < len(row) else ""
+
+def _load_and_stat_arrow(path):
+    tbl = pac.read_csv(
+        path,
+        convert_options=pac.ConvertOptions(
+            include_columns=["dns.qry.name", "frame.len", "frame.time_relative"],
+            include_missing_columns=True,
+            column_types={"dns.qry.name": pa.string(), "frame.len": pa.float64(), "frame.time_relative": pa.float64()},
+        ),
+    )
+    domains = [d.strip() for d in tbl["dns.qry.name"].to_pylist() if d]
+    total_bytes = int(pc.sum(tbl["frame.len"]).as_py() or 0)
+    t_first = pc.min(tbl["frame.time_relative"]).as_py()
+    t_last = pc.max(tbl["frame.time_relative"]).as_py()
+    return domains, total_bytes, t_first, t_last
+
+def load_and_stat(path):
+    """Single pass over the query CSV: (domains, total_bytes, t_first, t_last)."""
+    if pac is not None:
+        try:
+            return _load_and_stat_arrow(path)
+        except (pa.ArrowInvalid, UnicodeDecodeError):
+            pass  # malformed cells; the csv path below skips them row by row
+    domains = []
+    lens = []
+    times = []
     with open(path, "r", encoding="utf-8", errors="ignore") as h:
-        reader = csv.DictReader(h)
+        reader = csv.reader(h)
+        header = next(reader, [])
+        i_name = _col(header, "dns.qry.name")
+        i_len = _col(header, "frame.len")
+        i_trel = _col(header, "frame.time_relative")
         for r in reader:
-            fl = r.get("frame.len")
-            tr = r.get("frame.time_relative")
+            name = _cell(r, i_name)
+            fl = _cell(r, i_len)
+            tr = _cell(r, i_trel)
+            if name:
+                domains.append(name.strip())
             if fl:
-                try:
-                    total_bytes += int(float(fl))
-                except Exception:
-                    pass
+                lens.append(fl)
             if tr:
-                try:
-                    t = float(tr)
-                    if t_first is None or t < t_first:
-                        t_first = t
-                    if t_last is None or t > t_last:
-                        t_last = t
-                except Exception:
-                    pass
-    dur = (t_last - t_first) if (t_first is not None and t_last is not None and t_last > t_first) else 0.0
-    return total_bytes, dur
+                times.append(tr)
+    fl_arr = _float_array(lens)
+    tr_arr = _float_array(times)
+    total_bytes = int(np.trunc(fl_arr).sum())
+    t_first = float(tr_arr.min()) if tr_arr.size else None
+    t_last = float(tr_arr.max()) if tr_arr.size else None
+    return domains, total_bytes, t_first, t_last
 
+def _float_array(values):
+    # numpy parses the whole column in C; only fall back to per-cell
+    # conversion (dropping unparsable cells) when that fails.
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except ValueError:
+        pass
+    out = []
+    for v in values:
+        try:
+            out.append(float(v))
+        except ValueError:
+            pass
+    return np.fromiter(out, dtype=np.float64, count=len(out))
+
+def _duration(t_first, t_last):
+    return (t_last - t_first) if (t_first is not None and t_last is not None and t_last > t_first) else 0.0
+
+def load_queries(path):
+    return load_and_stat(path)[0]
+
+def pcap_stats(path: Path):
+    _, total_bytes, t_first, t_last = load_and_stat(path)
+    return total_bytes, _duration(t_first, t_last)
+
+def _usable_nameserver(ip):
+    try:
+        ip_obj = ip_address(ip)
+    except ValueError:
+        return False
+    return not ip_obj.is_loopback and not ip_obj.is_unspecified
+
+@functools.lru_cache(maxsize=1)
 def nameservers():
-    ns = []
     try:
         with open("/etc/resolv.conf") as h:
-            for line in h:
-                if line.startswith("nameserver"):
-                    ip = line.split()[1]
-                    try:
-                        ip_obj = ip_address(ip)
-                        if not ip_obj.is_loopback and not ip_obj.is_unspecified:
-                            ns.append(ip)
-                    except ValueError:
-                        pass
+            lines = h.read().splitlines()
     except Exception:
-        pass
-    return ns or ["8.8.8.8", "1.1.1.1"]
+        lines = []
+    fields = [line.split() for line in lines if line.startswith("nameserver")]
+    ns = tuple(f[1] for f in fields if len(f) > 1 and _usable_nameserver(f[1]))
+    return ns or ("8.8.8.8", "1.1.1.1")
 
-def perform_query(servers, domain, timeout, port):
+async def perform_query(servers, domain, timeout, port, sock=None):
     q = dns.message.make_query(domain, dns.rdatatype.A)
     q.flags |= dns.flags.RD
+    loop = asyncio.get_running_loop()
     last_exc = None
     for s in servers:
         try:
-            t0 = time.perf_counter()
-            resp = dns.query.udp(q, s, timeout=timeout, port=port)
-            dt = (time.perf_counter() - t0) * 1000.0
+            t0 = loop.time()
+            # A reused socket may still see late replies to an earlier query; skip those.
+            resp = await dns.asyncquery.udp(q, s, timeout=timeout, port=port, sock=sock, ignore_errors=sock is not None)
+            dt = (loop.time() - t0) * 1000.0
             status = dns.rcode.to_text(resp.rcode())
             answers = []
             for rrset in resp.answer:
@@ -84,18 +148,130 @@ def perform_query(servers, domain, timeout, port):
             continue
     return ("TIMEOUT" if last_exc else "ERROR"), 0.0, [], (servers[-1] if servers else "")
 
-def write_csv(path, records):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", newline="", encoding="utf-8") as h:
-        w = csv.writer(h)
-        w.writerow(["domain", "status", "query_time_ms", "resolver_ip", "answers"])
-        for r in records:
-            w.writerow([r["domain"], r["status"], f'{r["latency_ms"]:.3f}', r["resolver_ip"], ";".join(r["answers"])])
+async def run_all(servers, domains, timeout, port, concurrency, use_cache=True):
+    """Yield (domain, status, ms, answers, server, cached) for every input, in order."""
+    # Queries are RTT-bound, so keep up to `concurrency` of them in flight at once.
+    # Each in-flight query borrows one of `concurrency` long-lived UDP sockets
+    # (IPv4 resolvers only) instead of opening and closing a socket per query.
+    pool = asyncio.Queue()
+    socks = []
+    if all(ip_address(s).version == 4 for s in servers):
+        backend = dns.asyncbackend.get_default_backend()
+        for _ in range(min(concurrency, len(domains))):
+            socks.append(await backend.make_socket(socket.AF_INET, socket.SOCK_DGRAM, source=("0.0.0.0", 0)))
+    for sock in socks or [None] * concurrency:
+        pool.put_nowait(sock)
+
+    async def bounded(d):
+        sock = await pool.get()
+        try:
+            return await perform_query(servers, d, timeout, port, sock)
+        finally:
+            pool.put_nowait(sock)
+
+    try:
+        # Schedule a little ahead of the oldest row so one slow lookup does not
+        # leave the sockets idle.
+        async for rec in _iter_cached(domains, bounded, use_cache, 2 * concurrency):
+            yield rec
+    finally:
+        for sock in socks:
+            await sock.close()
+
+async def _iter_cached(domains, bounded, use_cache, window):
+    # Sliding window: at most `window` rows are scheduled but not yet yielded,
+    # and each is dropped once yielded, so memory does not grow with the input.
+    # Repeated domains reuse the first lookup's result and report 0 ms; only
+    # that per-domain result is kept, and only when caching is on.
+    first = {}
+    pending = deque()
+
+    async def _next_row():
+        d, entry, hit = pending.popleft()
+        res = await entry if asyncio.isfuture(entry) else entry
+        if use_cache and not hit:
+            first[d] = res
+        st, ms, ans, rip = res
+        return d, st, 0.0 if hit else ms, ans, rip, hit
+
+    try:
+        for d in domains:
+            if use_cache and d in first:
+                pending.append((d, first[d], True))
+            else:
+                task = asyncio.ensure_future(bounded(d))
+                if use_cache:
+                    first[d] = task
+                pending.append((d, task, False))
+            if len(pending) >= window:
+                yield await _next_row()
+        while pending:
+            yield await _next_row()
+    finally:
+        for _, entry, _ in pending:
+            if asyncio.isfuture(entry):
+                entry.cancel()
+
+# Rows are formatted by hand: every field except the domain is an IP list,
+# a number or a fixed token, so only the domain can ever need quoting.
+# "\r\n" matches what csv.writer produced before.
+_CSV_SPECIAL = frozenset(',"\r\n')
+
+def _csv_field(v):
+    if _CSV_SPECIAL.isdisjoint(v):
+        return v
+    return '"' + v.replace('"', '""') + '"'
+
+def write_csv(h):
+    """Write the results header to the open handle `h`."""
+    h.write("domain,status,query_time_ms,resolver_ip,answers,cached\r\n")
+
+async def replay(servers, domains, args, h):
+    """Run every query, writing each result row as it arrives; returns the counters."""
+    ok = 0
+    fail = 0
+    tout = 0
+    hits = 0
+    ok_net = 0  # successes that actually went to the network
+    cum = 0.0
+    async for d, st, ms, ans, rip, hit in run_all(servers, domains, args.timeout, args.port, max(1, args.concurrency), not args.no_cache):
+        if hit:
+            hits += 1
+        if st == "NOERROR" and ans:
+            ok += 1
+            if not hit:
+                ok_net += 1
+                cum += ms
+        else:
+            fail += 1
+            if st == "TIMEOUT":
+                tout += 1
+        h.write(f'{_csv_field(d)},{st},{ms:.3f},{rip},{";".join(ans)},{"true" if hit else "false"}\r\n')
+    return ok, fail, tout, hits, ok_net, cum
+
+_MKDIRS = set()
+_COMPARE_HEADER = ["Label", "Total", "Success", "Failure", "Timeouts", "Avg Latency (ms)", "Throughput (qps)", "Throughput (bps)"]
+_COMPARE_STARTED = set()
+
+def _ensure_dir(p):
+    if p not in _MKDIRS:
+        p.mkdir(parents=True, exist_ok=True)
+        _MKDIRS.add(p)
+
+def _append_comparison(path, row):
+    """Append one row to summary_comparison.csv, writing the header for a new file."""
+    new_file = path not in _COMPARE_STARTED and not path.exists()
+    with open(path, "a", encoding="utf-8") as h:
+        writer = csv.writer(h)
+        if new_file:
+            writer.writerow(_COMPARE_HEADER)
+        writer.writerow(row)
+    _COMPARE_STARTED.add(path)
 
 def write_summary(label, path, total, succ, fail, timeouts, cum_ms, dur_s):
     avg = (cum_ms / succ) if succ else 0.0
     thr = (total / dur_s) if dur_s > 0 else 0.0
-    path.parent.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(path.parent)
     with open(path, "w", encoding="utf-8") as h:
         h.write(f"Total Queries: {total}\n")
         h.write(f"Successful Resolutions: {succ}\n")
@@ -104,13 +280,7 @@ def write_summary(label, path, total, succ, fail, timeouts, cum_ms, dur_s):
         h.write(f"Average Lookup Latency (ms): {avg:.2f}\n")
         h.write(f"Average Throughput (queries/sec): {thr:.2f}\n")
 
-    compare_csv_path = path.parent / "summary_comparison.csv"
-    file_exists = os.path.exists(compare_csv_path)
-    with open(compare_csv_path, "a", encoding="utf-8") as h:
-        writer = csv.writer(h)
-        if not file_exists:
-            writer.writerow(["Label", "Total", "Success", "Failure", "Timeouts", "Avg Latency (ms)", "Throughput (qps)", "Throughput (bps)"])
-        writer.writerow([label, total, succ, fail, timeouts, avg, thr])
+    _append_comparison(path.parent / "summary_comparison.csv", [label, total, succ, fail, timeouts, avg, thr])
 
 
 def main():
@@ -119,6 +289,8 @@ def main():
     p.add_argument("--query-file")
     p.add_argument("--timeout", type=float, default=2.0)
     p.add_argument("--port", type=int, default=53)
+    p.add_argument("--concurrency", type=int, default=100)
+    p.add_argument("--no-cache", action="store_true", help="re-query repeated domains instead of reusing the first result")
     p.add_argument("--output-dir", default="results/system")
     args = p.parse_args()
     print(f"Label: {args.label}")
@@ -127,60 +299,42 @@ def main():
     qpath = Path(args.query_file)
     if not qpath.exists():
         raise SystemExit(f"missing {qpath}")
-    domains = load_queries(qpath)
+    domains, pcap_bytes, t_first, t_last = load_and_stat(qpath)
     if not domains:
         raise SystemExit("no queries")
-
-    pcap_bytes, pcap_dur = pcap_stats(qpath)
+    pcap_dur = _duration(t_first, t_last)
 
     resolvers = nameservers()
     out_dir = Path(args.output_dir)
     csv_path = out_dir / f"{args.label}_system_results.csv"
     sum_path = out_dir / f"{args.label}_system_summary.txt"
 
-    recs = []
-    ok = 0
-    fail = 0
-    tout = 0
-    cum = 0.0
-    t0 = time.perf_counter()
-    for d in domains:
-        st, ms, ans, rip = perform_query(resolvers, d, args.timeout, args.port)
-        if st == "NOERROR" and ans:
-            ok += 1
-            cum += ms
-        else:
-            fail += 1
-            if st == "TIMEOUT":
-                tout += 1
-        recs.append({"domain": d, "status": st, "latency_ms": ms, "resolver_ip": rip, "answers": ans})
-    dur = time.perf_counter() - t0
+    _ensure_dir(csv_path.parent)
+    with open(csv_path, "w", newline="", encoding="utf-8") as h:
+        write_csv(h)
+        t0 = time.perf_counter()
+        ok, fail, tout, hits, ok_net, cum = asyncio.run(replay(resolvers, domains, args, h))
+        dur = time.perf_counter() - t0
 
-    write_csv(csv_path, recs)
     # Calculate bps from PCAP frame.len over PCAP duration; if unavailable, fall back to runtime duration.
     denom = pcap_dur if pcap_dur > 0 else (dur if dur > 0 else 1e-9)
     bps = 8.0 * pcap_bytes / denom
 
-    avg = (cum / ok) if ok else 0.0
+    avg = (cum / ok_net) if ok_net else 0.0
     thr = (len(domains) / dur) if dur > 0 else 0.0
-    sum_path.parent.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(sum_path.parent)
     with open(sum_path, "w", encoding="utf-8") as h:
         h.write(f"Total Queries: {len(domains)}\n")
         h.write(f"Successful Resolutions: {ok}\n")
         h.write(f"Failed Resolutions: {fail}\n")
         h.write(f"Timeout Failures: {tout}\n")
+        h.write(f"Cache Hits: {hits}\n")
         h.write(f"Average Lookup Latency (ms): {avg:.2f}\n")
         h.write(f"Average Throughput (queries/sec): {thr:.2f}\n")
         h.write(f"Throughput (bps, from PCAP frame.len): {bps:.2f}\n")
         h.write(f"Total Bytes (from PCAP frame.len): {pcap_bytes}\n")
 
-    compare_csv_path = sum_path.parent / "summary_comparison.csv"
-    file_exists = os.path.exists(compare_csv_path)
-    with open(compare_csv_path, "a", encoding="utf-8") as h:
-        writer = csv.writer(h)
-        if not file_exists:
-            writer.writerow(["Label", "Total", "Success", "Failure", "Timeouts", "Avg Latency (ms)", "Throughput (qps)", "Throughput (bps)"])
-        writer.writerow([args.label, len(domains), ok, fail, tout, avg, thr, bps])
+    _append_comparison(sum_path.parent / "summary_comparison.csv", [args.label, len(domains), ok, fail, tout, avg, thr, bps])
     print(f"Results written to {csv_path} and {sum_path}")
 
 if __name__ == "__main__":
@@ -7,6 +7,11 @@ from mininet.node import Node
 from mininet.topo import Topo
 from mininet.clean import cleanup
 
+# Shape bandwidth with a single tbf qdisc instead of TCLink's default HTB
+# hierarchy: bw isn't the bottleneck for DNS traffic, and the lighter qdisc
+# keeps per-packet overhead (and latency jitter) down.
+LINK_SHAPING = {"use_tbf": True}
+
 
 class ImageTopo(Topo):
     """Four hosts and a DNS server connected in a line of switches."""
@@ -26,23 +31,23 @@ class ImageTopo(Topo):
         s4 = self.addSwitch("s4", failMode="standalone")
 
         # --- Host to switch links ---
-        self.addLink(h1, s1, bw=100, delay="2ms")
-        self.addLink(h2, s2, bw=100, delay="2ms")
-        self.addLink(h3, s3, bw=100, delay="2ms")
-        self.addLink(h4, s4, bw=100, delay="2ms")
-        self.addLink(dns_host, s2, bw=100, delay="1ms")
+        self.addLink(h1, s1, bw=100, delay="2ms", **LINK_SHAPING)
+        self.addLink(h2, s2, bw=100, delay="2ms", **LINK_SHAPING)
+        self.addLink(h3, s3, bw=100, delay="2ms", **LINK_SHAPING)
+        self.addLink(h4, s4, bw=100, delay="2ms", **LINK_SHAPING)
+        self.addLink(dns_host, s2, bw=100, delay="1ms", **LINK_SHAPING)
 
         # --- Switch cascade ---
-        self.addLink(s1, s2, bw=100, delay="5ms")
-        self.addLink(s2, s3, bw=100, delay="8ms")
-        self.addLink(s3, s4, bw=100, delay="10ms")
+        self.addLink(s1, s2, bw=100, delay="5ms", **LINK_SHAPING)
+        self.addLink(s2, s3, bw=100, delay="8ms", **LINK_SHAPING)
+        self.addLink(s3, s4, bw=100, delay="10ms", **LINK_SHAPING)
 
 
 def _attach_nat(net: Mininet, switch_name: str, gateway_ip: str) -> Node:
     """Attach a NAT node to the topology for Internet reachability."""
 
     nat = net.addNAT(name="nat0", connect=False, inNamespace=False, ip=f"{gateway_ip}/24")
-    net.addLink(nat, net.get(switch_name), bw=100, delay="1ms")
+    net.addLink(nat, net.get(switch_name), bw=100, delay="1ms", **LINK_SHAPING)
     return nat
 
 
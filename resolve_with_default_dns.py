@@ -3,19 +3,44 @@ import csv
 import os
 import socket
 import time
-import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pac
+except ImportError:  # optional: fall back to the csv module
+    pa = pac = None
+
+
+BATCH_SIZE = 10_000  # rows read, resolved and written per batch
 
-def resolve_domains(csv_path: str, output_path: str):
-    results = []
-    total_queries = 0
-    success_count = 0
-    failure_count = 0
-    latencies = []
-    total_bytes = 0  # sum of frame.len for successful queries
 
-    # Start measuring total runtime
-    experiment_start = time.time()
+def iter_query_batches(csv_path: str, batch_size: int = BATCH_SIZE):
+    """Yield lists of (domain, frame_len) for the non-empty query rows, a batch at a time."""
+    if pac is not None:
+        reader = pac.open_csv(
+            csv_path,
+            convert_options=pac.ConvertOptions(
+                include_columns=["dns.qry.name", "frame.len"],
+                column_types={"dns.qry.name": pa.string(), "frame.len": pa.float64()},
+            ),
+        )
+        # pyarrow's record batches follow its read block size; re-chunk them
+        # so this path yields batch_size rows per batch like the csv one.
+        pending = []
+        for record_batch in reader:
+            names = record_batch.column("dns.qry.name").to_pylist()
+            lens = record_batch.column("frame.len").fill_null(0).to_pylist()
+            pending.extend((d.strip(), fl) for d, fl in zip(names, lens) if d and d.strip())
+            full = len(pending) - len(pending) % batch_size
+            for i in range(0, full, batch_size):
+                yield pending[i:i + batch_size]
+            del pending[:full]
+        if pending:
+            yield pending
+        return
 
+    batch = []
     with open(csv_path, newline="") as f:
         reader = csv.DictReader(f)
         for row in reader:
@@ -24,26 +49,61 @@ def resolve_domains(csv_path: str, output_path: str):
 
             if not domain:
                 continue
-            total_queries += 1
-
-            start_time = time.time()
-            try:
-                socket.gethostbyname(domain)
-                latency = (time.time() - start_time) * 1000  # in ms
-                success_count += 1
-                latencies.append(latency)
-                total_bytes += frame_len
-                results.append((domain, "SUCCESS", latency, frame_len))
-            except Exception:
-                latency = (time.time() - start_time) * 1000
-                failure_count += 1
-                results.append((domain, "FAILED", latency, frame_len))
+            batch.append((domain, frame_len))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def timed_resolve(domain: str, frame_len: float):
+    start_time = time.time()
+    try:
+        socket.gethostbyname(domain)
+        status = "SUCCESS"
+    except Exception:
+        status = "FAILED"
+    latency = (time.time() - start_time) * 1000  # in ms
+    return domain, status, latency, frame_len
+
+
+def resolve_domains(csv_path: str, output_path: str, workers: int = 64):
+    total_queries = 0
+    success_count = 0
+    failure_count = 0
+    latency_sum = 0.0  # over successful queries; avg = latency_sum / success_count
+    total_bytes = 0  # sum of frame.len for successful queries
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(["domain", "status", "latency_ms", "frame_len"])
+
+        # Start measuring total runtime
+        experiment_start = time.time()
+
+        # Rows are read, resolved and written one batch at a time, so memory
+        # stays flat however large the input is. gethostbyname blocks on the
+        # OS resolver, so each batch's lookups overlap in threads; executor.map
+        # keeps results in input order.
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for batch in iter_query_batches(csv_path):
+                results = list(executor.map(lambda q: timed_resolve(*q), batch))
+                for domain, status, latency, frame_len in results:
+                    if status == "SUCCESS":
+                        success_count += 1
+                        latency_sum += latency
+                        total_bytes += frame_len
+                    else:
+                        failure_count += 1
+                total_queries += len(results)
+                writer.writerows(results)
 
     experiment_end = time.time()
     total_duration = experiment_end - experiment_start  # seconds
 
     # --- Compute metrics ---
-    avg_latency = statistics.mean(latencies) if latencies else 0
+    avg_latency = latency_sum / success_count if success_count else 0
     avg_throughput_qps = total_queries / total_duration if total_duration > 0 else 0
     total_bits = total_bytes * 8
     throughput_bps = total_bits / total_duration if total_duration > 0 else 0
@@ -58,13 +118,6 @@ def resolve_domains(csv_path: str, output_path: str):
         "throughput_bps": round(throughput_bps, 3),
     }
 
-    # --- Save detailed results ---
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w", newline="") as out:
-        writer = csv.writer(out)
-        writer.writerow(["domain", "status", "latency_ms", "frame_len"])
-        writer.writerows(results)
-
     # --- Print summary ---
     print(f"\n=== Results for {csv_path} ===")
     for k, v in summary.items():
@@ -97,6 +150,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Resolve domains using system DNS resolver")
     parser.add_argument("--input", required=True, help="Path to input CSV of queries")
     parser.add_argument("--output", required=True, help="Path to save results CSV")
+    parser.add_argument("--workers", type=int, default=64, help="Number of concurrent lookups (default: 64)")
     args = parser.parse_args()
 
-    resolve_domains(args.input, args.output)
+    resolve_domains(args.input, args.output, args.workers)